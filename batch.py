@@ -0,0 +1,214 @@
+import asyncio
+import contextlib
+import logging
+import os
+import re
+
+from telegram import InputMediaAudio
+from telegram.error import BadRequest
+
+from youtube import download_from_youtube, extract_video_id, extract_playlist_id, list_playlist
+from instagram import download_from_instagram, extract_media_id, canonical_url
+from media_cache import file_id_cache, media_key
+from singleflight import downloads
+from formats import MAX_UPLOAD_BYTES
+from metrics import timer, OUTCOMES, BYTES_UPLOADED
+
+logger = logging.getLogger(__name__)
+
+# Bitta xabardan ko'pi bilan nechta trek yuboriladi va nechtasi bir vaqtda yuklanadi
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "50"))
+BATCH_PARALLEL = int(os.environ.get("BATCH_PARALLEL", "3"))
+BATCH_ITEM_TIMEOUT = float(os.environ.get("BATCH_ITEM_TIMEOUT", "180"))
+# Progress xabari ko'pi bilan shuncha soniyada bir marta tahrirlanadi
+BATCH_PROGRESS_INTERVAL = float(os.environ.get("BATCH_PROGRESS_INTERVAL", "3"))
+
+# Telegram albomi (sendMediaGroup) 2..10 ta fayl qabul qiladi
+MEDIA_GROUP_SIZE = 10
+
+_LINK_RE = re.compile(r"(?:https?://|www\.)\S*(?:youtube\.com|youtu\.be|instagram\.com)\S*")
+
+
+class BatchItem:
+    """One track of a batch: cache key, download function and its argument."""
+
+    __slots__ = ("key", "func", "arg", "title")
+
+    def __init__(self, key: str, func, arg: str, title: str | None = None):
+        self.key = key
+        self.func = func
+        self.arg = arg
+        self.title = title
+
+
+def _item_for_link(link: str) -> BatchItem | None:
+    if "instagram.com" in link:
+        url = canonical_url(link) or link
+        return BatchItem(media_key("ig", extract_media_id(url) or url, "audio"), download_from_instagram, url)
+    video_id = extract_video_id(link)
+    if video_id:
+        return BatchItem(media_key("yt", video_id, "audio"), download_from_youtube, video_id)
+    return None
+
+
+async def collect_batch(text: str) -> list[BatchItem] | None:
+    """Tracks of a playlist link or of a message with several links; None for a normal request."""
+    links = _LINK_RE.findall(text or "")
+    playlist_id = next((pid for pid in map(extract_playlist_id, links) if pid), None)
+    if playlist_id:
+        entries = await asyncio.wait_for(asyncio.to_thread(list_playlist, playlist_id), 30)
+        items = [
+            BatchItem(media_key("yt", entry["id"], "audio"), download_from_youtube, entry["id"], entry["title"])
+            for entry in entries
+        ]
+    elif len(links) > 1:
+        items = [item for item in map(_item_for_link, links) if item]
+    else:
+        return None
+    # Bir xil havola ikki marta yuborilsa — bir marta
+    unique = {}
+    for item in items:
+        unique.setdefault(item.key, item)
+    return list(unique.values())[:BATCH_MAX_ITEMS]
+
+
+class _Progress:
+    """Edits one status message with "done/total", at most every BATCH_PROGRESS_INTERVAL seconds."""
+
+    def __init__(self, status, total: int):
+        self.status = status
+        self.total = total
+        self.done = 0
+        self._changed = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def step(self) -> None:
+        self.done += 1
+        self._changed.set()
+
+    async def _run(self) -> None:
+        while self.done < self.total:
+            await self._changed.wait()
+            self._changed.clear()
+            try:
+                await self.status.edit_text(f"📦 Yuklanmoqda: {self.done}/{self.total}")
+            except BadRequest:
+                pass
+            await asyncio.sleep(BATCH_PROGRESS_INTERVAL)
+
+    async def finish(self, text: str) -> None:
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+        try:
+            await self.status.edit_text(text)
+        except BadRequest:
+            pass
+
+
+async def send_batch(message, items: list[BatchItem], user_id: int | None = None) -> None:
+    """Download items with at most BATCH_PARALLEL in flight and send them as albums of up to 10.
+
+    Albums go out in the original order as soon as all of their tracks are
+    ready, while the rest keep downloading. Tracks with a cached file_id are
+    not downloaded again; oversized or failed tracks are skipped and counted
+    in the final status message.
+    """
+    status = await message.reply_text(f"📦 {len(items)} ta trek topildi. Yuklanmoqda: 0/{len(items)}")
+    progress = _Progress(status, len(items))
+    slots = asyncio.Semaphore(BATCH_PARALLEL)
+
+    async def fetch(item: BatchItem):
+        try:
+            file_id = file_id_cache.get(item.key)
+            if file_id:
+                OUTCOMES.inc(outcome="cache_hit")
+                return file_id
+            async with slots:
+                return await downloads.acquire(item.key, item.func, item.arg,
+                                               timeout=BATCH_ITEM_TIMEOUT, user_id=user_id)
+        finally:
+            progress.step()
+
+    tasks = [asyncio.create_task(fetch(item)) for item in items]
+    sent = skipped = failed = 0
+    try:
+        for start in range(0, len(items), MEDIA_GROUP_SIZE):
+            chunk = items[start:start + MEDIA_GROUP_SIZE]
+            results = await asyncio.gather(*tasks[start:start + MEDIA_GROUP_SIZE], return_exceptions=True)
+            ok, too_large, errors = await _send_album(message, chunk, results)
+            sent, skipped, failed = sent + ok, skipped + too_large, failed + errors
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Yuborilmay qolgan (bekor qilingan) yuklashlarning lease'larini qaytaramiz
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if hasattr(result, "release"):
+                result.release()
+
+    summary = f"✅ Yuborildi: {sent}/{len(items)}"
+    if skipped:
+        summary += f" · juda katta: {skipped}"
+    if failed:
+        summary += f" · xato: {failed}"
+    await progress.finish(summary)
+
+
+async def _send_album(message, items: list[BatchItem], results: list) -> tuple[int, int, int]:
+    """Send one album; returns (sent, too_large, failed) counts."""
+    sources, titles, keys, sizes, leases = [], [], [], [], []
+    too_large = failed = 0
+    with contextlib.ExitStack() as files:
+        for item, result in zip(items, results):
+            if isinstance(result, BaseException):
+                logger.warning("Batch: %s yuklanmadi: %s", item.key, result)
+                OUTCOMES.inc(outcome="error")
+                failed += 1
+                continue
+            if isinstance(result, str):
+                # file_id — qayta yuklash shart emas
+                sources.append(result)
+                titles.append(item.title)
+                keys.append(None)
+                continue
+            leases.append(result)
+            try:
+                size = os.path.getsize(result.path)
+            except OSError:
+                size = 0
+            if size > MAX_UPLOAD_BYTES:
+                OUTCOMES.inc(outcome="too_large")
+                too_large += 1
+                continue
+            sources.append(files.enter_context(open(result.path, "rb")))
+            titles.append(item.title)
+            keys.append(item.key)
+            sizes.append(size)
+        try:
+            if not sources:
+                return 0, too_large, failed
+            with timer("upload", kind="album"):
+                if len(sources) == 1:
+                    messages = [await message.reply_audio(sources[0], title=titles[0])]
+                else:
+                    messages = list(await message.reply_media_group(
+                        [InputMediaAudio(source, title=title) for source, title in zip(sources, titles)]
+                    ))
+        except BadRequest as e:
+            # Albomdagi eskirgan file_id ham butun albomni rad ettiradi
+            logger.warning("Batch albom yuborilmadi: %s", e)
+            for item, result in zip(items, results):
+                if isinstance(result, str):
+                    file_id_cache.forget(item.key)
+            OUTCOMES.inc(outcome="error")
+            return 0, too_large, failed + len(sources)
+        finally:
+            for lease in leases:
+                lease.release()
+
+    BYTES_UPLOADED.inc(sum(sizes))
+    for key, sent in zip(keys, messages):
+        if key and sent.audio:
+            file_id_cache.put(key, sent.audio.file_id)
+    OUTCOMES.inc(len(messages), outcome="ok")
+    return len(messages), too_large, failed
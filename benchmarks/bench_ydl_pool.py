@@ -0,0 +1,70 @@
+"""Micro-benchmark: per-call YoutubeDL setup cost, fresh instance vs pool checkout.
+
+Runs offline: it measures what every call paid before pooling (building a
+YoutubeDL and initializing its extractor) against borrowing a warm instance.
+Pass --network QUERY to also time a real flat ytsearch both ways.
+
+    python benchmarks/bench_ydl_pool.py [-n 50] [--network "shahzoda yomg'ir"]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yt_dlp  # noqa: E402
+
+from youtube import SEARCH_POOL  # noqa: E402
+
+
+def _fresh_call(query: str | None) -> None:
+    with yt_dlp.YoutubeDL(SEARCH_POOL.opts) as ydl:
+        ydl.get_info_extractor("YoutubeSearch")
+        if query:
+            ydl.extract_info(f"ytsearch1:{query}", download=False)
+
+
+def _pooled_call(query: str | None) -> None:
+    with SEARCH_POOL.checkout() as ydl:
+        ydl.get_info_extractor("YoutubeSearch")
+        if query:
+            ydl.extract_info(f"ytsearch1:{query}", download=False)
+
+
+def _measure(func, n: int, query: str | None) -> list[float]:
+    samples = []
+    for _ in range(n):
+        started = time.perf_counter()
+        func(query)
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def _report(label: str, samples: list[float]) -> None:
+    samples = sorted(samples)
+    print(f"{label:<10} mean {statistics.mean(samples):8.2f} ms   "
+          f"p50 {samples[len(samples) // 2]:8.2f} ms   p95 {samples[int(len(samples) * 0.95)]:8.2f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", type=int, default=50, help="calls per variant")
+    parser.add_argument("--network", metavar="QUERY", help="also run a real ytsearch1 per call")
+    args = parser.parse_args()
+
+    # Import/registry cost is paid once either way; exclude it from both sides
+    _fresh_call(None)
+    SEARCH_POOL.warm_up(1)
+
+    fresh = _measure(_fresh_call, args.n, args.network)
+    pooled = _measure(_pooled_call, args.n, args.network)
+    _report("fresh", fresh)
+    _report("pooled", pooled)
+    print(f"speedup    x{statistics.mean(fresh) / max(statistics.mean(pooled), 1e-9):.1f} "
+          f"(instances created by pool: {SEARCH_POOL.created})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Cold-start benchmark: import time, time to first reply and time to /ready.
+
+Two measurements, each in fresh interpreters:
+
+* ``import bot`` wall time (median of --imports runs) and whether yt_dlp got
+  loaded by it;
+* a full start: a child process runs the real bot (bot._run, long polling)
+  against the fake Bot API from loadtest.py. A /ping update is queued before
+  the child starts, and the parent records when the first getUpdates, the
+  first sendMessage (the pong) and the first 200 from GET /ready arrive,
+  all measured from process spawn.
+
+    python benchmarks/startup.py [--runs 5] [--imports 10] [--eager] [--json]
+
+--eager imports yt_dlp before bot in every child, which approximates the
+startup cost before heavy imports were deferred. Runs offline.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from loadtest import TOKEN, FakeBotApi  # noqa: E402
+
+_IMPORT_SNIPPET = (
+    "import sys, time; sys.path.insert(0, {root!r}); "
+    "t = time.perf_counter(); {eager}import bot; "
+    "print(time.perf_counter() - t, 'yt_dlp' in sys.modules)"
+)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_import(runs: int, eager: bool) -> dict:
+    samples, loaded = [], False
+    code = _IMPORT_SNIPPET.format(root=REPO_ROOT, eager="import yt_dlp; " if eager else "")
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                             env={**os.environ, "BOT_TOKEN": TOKEN}, cwd=tempfile.mkdtemp(prefix="bot-startup-"))
+        seconds, yt_dlp_loaded = out.stdout.split()
+        samples.append(float(seconds))
+        loaded = loaded or yt_dlp_loaded == "True"
+    return {"median_s": statistics.median(samples), "min_s": min(samples), "yt_dlp_loaded": loaded}
+
+
+def _ready(port: int) -> bool:
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/ready", timeout=1) as r:
+            return r.status == 200
+    except (urllib.error.URLError, OSError):
+        return False
+
+
+async def measure_start(eager: bool, timeout: float) -> dict:
+    import webserver
+
+    server = webserver.WebServer("127.0.0.1", 0)
+    api = FakeBotApi(server, latency=0.0)
+    await server.start()
+    port = server._server.sockets[0].getsockname()[1]
+    metrics_port = _free_port()
+    # /ping bot ishga tushishidan oldin navbatda turadi (drop_pending_updates uni o'chirmaydi)
+    api.offer({"update_id": 1, "message": {
+        "message_id": 1, "date": int(time.time()), "text": "/ping",
+        "entities": [{"type": "bot_command", "offset": 0, "length": 5}],
+        "chat": {"id": 1, "type": "private"}, "from": {"id": 1, "is_bot": False, "first_name": "bench"},
+    }})
+
+    scratch = tempfile.mkdtemp(prefix="bot-startup-")
+    env = {**os.environ, "BOT_TOKEN": TOKEN, "BOT_MODE": "polling", "BOT_WORKERS": "1",
+           "METRICS_PORT": str(metrics_port), "MEDIA_CACHE_DB": os.path.join(scratch, "media_cache.sqlite3")}
+    args = [sys.executable, os.path.abspath(__file__), "--child", str(port)] + (["--eager"] if eager else [])
+    started = time.perf_counter()
+    child = subprocess.Popen(args, env=env, cwd=scratch, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    marks = {}
+    try:
+        while "ready_s" not in marks or "first_reply_s" not in marks:
+            now = time.perf_counter() - started
+            if now > timeout or child.poll() is not None:
+                raise RuntimeError(f"bot did not become ready within {now:.1f}s (exit code {child.poll()})")
+            if api.calls["getUpdates"] and "polling_s" not in marks:
+                marks["polling_s"] = now
+            if api.calls["sendMessage"] and "first_reply_s" not in marks:
+                marks["first_reply_s"] = now
+            if "ready_s" not in marks and await asyncio.to_thread(_ready, metrics_port):
+                marks["ready_s"] = time.perf_counter() - started
+            await asyncio.sleep(0.005)
+    finally:
+        child.send_signal(2)
+        api.close()
+        try:
+            child.wait(10)
+        except subprocess.TimeoutExpired:
+            child.kill()
+        await server.stop()
+    return marks
+
+
+def run_child(port: int, eager: bool) -> None:
+    """Child process: start the bot exactly like main() does, against the fake API."""
+    if eager:
+        import yt_dlp  # noqa: F401
+    import bot
+
+    bot._run(bot.build_application(TOKEN, base_url=f"http://127.0.0.1:{port}/bot"))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="full starts to measure")
+    parser.add_argument("--imports", type=int, default=10, help="'import bot' runs to measure")
+    parser.add_argument("--eager", action="store_true", help="import yt_dlp up front (old behaviour)")
+    parser.add_argument("--timeout", type=float, default=60, help="give up on a start after this many seconds")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--child", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child(args.child, args.eager)
+        return
+
+    import logging
+    logging.disable(logging.WARNING)
+    report = {"eager": args.eager, "import": measure_import(args.imports, args.eager), "start": {}}
+    starts = [asyncio.run(measure_start(args.eager, args.timeout)) for _ in range(args.runs)]
+    for mark in ("polling_s", "first_reply_s", "ready_s"):
+        samples = [s[mark] for s in starts if mark in s]
+        if samples:
+            report["start"][mark] = {"median": statistics.median(samples), "max": max(samples)}
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    imp = report["import"]
+    print(f"import bot:      median {imp['median_s']:.3f}s, min {imp['min_s']:.3f}s"
+          f" (yt_dlp {'loaded' if imp['yt_dlp_loaded'] else 'not loaded'})")
+    labels = {"polling_s": "polling started", "first_reply_s": "first reply", "ready_s": "/ready 200"}
+    for mark, row in report["start"].items():
+        print(f"{labels[mark] + ':':<16} median {row['median']:.3f}s, max {row['max']:.3f}s   (from spawn)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,19 @@
+import asyncio
 import logging
 import os
-import requests
 from telegram.error import Conflict
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler, InlineQueryHandler
 from handlers import start, search_song, button, error_handler, ping
+from inline import inline_query
+from update_processor import ChatOrderedUpdateProcessor
+from rate_limiter import TelegramRateLimiter
+from ydl_pool import warm_up_pools
+from disk_cache import disk_cache
+from prefetch import prefetcher
+from webhook import run_webhook, add_metrics_route, add_ready_route
+from readiness import readiness
+from webserver import WebServer
+from workers import BOT_WORKERS, WorkerPool, build_ingest_application
 
 # Enable logging
 logging.basicConfig(
@@ -13,29 +23,86 @@ logger = logging.getLogger(__name__)
 
 # Read token from environment for deployment safety
 TOKEN = os.environ.get("BOT_TOKEN")
+# "polling" (standart) yoki "webhook"
+BOT_MODE = os.environ.get("BOT_MODE", "polling").strip().lower()
+# Polling rejimida /metrics uchun alohida port (bo'sh bo'lsa — o'chirilgan)
+METRICS_PORT = os.environ.get("METRICS_PORT", "")
 
-def main() -> None:
-    """Start the bot."""
-    if not TOKEN:
-        logger.error("BOT_TOKEN environment variable is not set.")
-        raise SystemExit("BOT_TOKEN environment variable is not set.")
-    # Try deleting webhook to avoid mixed modes
+def _warm_up() -> None:
+    """Rebuild the disk cache index and warm up YoutubeDL pools (runs in a worker thread)."""
     try:
-        resp = requests.get(f"https://api.telegram.org/bot{TOKEN}/deleteWebhook", timeout=10)
-        if resp.ok:
-            logger.info("Webhook o‘chirildi yoki mavjud emas edi (OK).")
-        else:
-            logger.warning("Webhook o‘chirishda muammo: %s", resp.text)
+        disk_cache.sweep()
     except Exception as e:
-        logger.warning("Webhook o‘chirib bo‘lmadi: %s", e)
+        logger.warning("Disk cache sweep bajarilmadi: %s", e)
+    try:
+        warm_up_pools()
+    finally:
+        readiness.mark("warm_up")
+
+async def post_init(application: Application) -> None:
+    """Run the warm-up in the background so the first request is not cold."""
+    # Yetim scratch fayllarini birorta yuklash boshlanishidan oldin o'chiramiz
+    try:
+        disk_cache.sweep_scratch()
+    except OSError as e:
+        logger.warning("Scratch papka tozalanmadi: %s", e)
+    asyncio.get_running_loop().run_in_executor(None, _warm_up)
+    # initialize() (getMe) shu yerga kelguncha tugagan
+    readiness.mark("telegram")
+    # Webhook rejimida /metrics va /ready asosiy serverda; polling'da alohida port kerak
+    if METRICS_PORT and BOT_MODE != "webhook":
+        server = WebServer(port=int(METRICS_PORT))
+        add_metrics_route(server)
+        add_ready_route(server)
+        await server.start()
+        application.bot_data["metrics_server"] = server
+
+async def ingest_post_init(application: Application) -> None:
+    """Readiness for the ingest process: downloads and their warm-up live in the workers."""
+    readiness.mark("warm_up")
+    readiness.mark("telegram")
+
+async def post_shutdown(application: Application) -> None:
+    prefetcher.cancel_all()
+    server = application.bot_data.pop("metrics_server", None)
+    if server is not None:
+        await server.stop()
+
+def build_application(token: str, **builder_options) -> Application:
+    """Build the Application with all handlers registered.
 
-    application = Application.builder().token(TOKEN).build()
+    ``builder_options`` maps to ApplicationBuilder methods (e.g. base_url=...).
+    """
+    # Turli chatlar parallel ishlanadi, bitta chat ichida tartib saqlanadi
+    builder = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(ChatOrderedUpdateProcessor())
+        .rate_limiter(TelegramRateLimiter())
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    for name, value in builder_options.items():
+        builder = getattr(builder, name)(value)
+    application = builder.build()
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("ping", ping))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, search_song))
     application.add_handler(CallbackQueryHandler(button))
+    application.add_handler(InlineQueryHandler(inline_query))
     application.add_error_handler(error_handler)
+    return application
+
+def _run(application: Application) -> None:
+    """Receive updates via webhook or long polling until stopped."""
+    if BOT_MODE == "webhook":
+        logger.info("Bot ishga tushmoqda (webhook)...")
+        asyncio.run(run_webhook(application, TOKEN))
+        return
+
+    # Eski webhook'ni run_polling o'zi o'chiradi: bootstrap paytida deleteWebhook
+    # (drop_pending_updates bilan) asinxron va qayta urinishlar bilan chaqiriladi
     logger.info("Bot ishga tushmoqda (polling, drop_pending_updates=True)...")
     try:
         application.run_polling(drop_pending_updates=True)
@@ -46,5 +113,25 @@ def main() -> None:
         )
         raise SystemExit(1)
 
+def main() -> None:
+    """Start the bot."""
+    if not TOKEN:
+        logger.error("BOT_TOKEN environment variable is not set.")
+        raise SystemExit("BOT_TOKEN environment variable is not set.")
+
+    pool = None
+    if BOT_WORKERS > 1:
+        # Bu jarayon faqat update qabul qiladi; handlerlar worker jarayonlarida ishlaydi
+        pool = WorkerPool(TOKEN, BOT_WORKERS)
+        pool.start()
+        application = build_ingest_application(TOKEN, pool, post_init=ingest_post_init)
+    else:
+        application = build_application(TOKEN)
+    try:
+        _run(application)
+    finally:
+        if pool is not None:
+            pool.stop()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from media_cache import DB_PATH
+
+logger = logging.getLogger(__name__)
+
+# Tugmalar qancha vaqt ishlaydi; bo'sh CALLBACK_DB — faqat xotirada (restartda yo'qoladi)
+CALLBACK_TTL = float(os.environ.get("CALLBACK_TTL_HOURS", "24")) * 3600
+CALLBACK_DB = os.environ.get("CALLBACK_DB", DB_PATH)
+CALLBACK_MEMORY_SIZE = int(os.environ.get("CALLBACK_MEMORY_SIZE", "10000"))
+
+# Har shuncha yozuvdan keyin SQLite'dan eskirganlar o'chiriladi
+_PURGE_EVERY = 256
+
+
+class CallbackStore:
+    """Short token -> payload dict for inline button callback_data (<= 64 bytes).
+
+    Tokens are a hash of the payload, so storing the same payload twice gives
+    the same token. Every entry lives for the same TTL, which keeps the
+    in-memory OrderedDict sorted by expiry: inserts and lookups are O(1) and
+    expired entries are popped from the front as new ones arrive. With a
+    database path, entries are also written to SQLite, so buttons survive
+    restarts and work in every worker process.
+    """
+
+    def __init__(self, path: str = CALLBACK_DB, ttl: float = CALLBACK_TTL, max_memory: int = CALLBACK_MEMORY_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.max_memory = max_memory
+        self._entries: OrderedDict[str, tuple[dict, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS callback_tokens ("
+                " token TEXT PRIMARY KEY,"
+                " payload TEXT NOT NULL,"
+                " expires REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS callback_tokens_expires ON callback_tokens (expires)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def token_for(payload: dict) -> str:
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:24]
+
+    def put(self, payload: dict) -> str:
+        """Store payload and return its token."""
+        token = self.token_for(payload)
+        now = time.time()
+        expires = now + self.ttl
+        with self._lock:
+            self._entries.pop(token, None)
+            self._entries[token] = (payload, expires)
+            self._evict(now)
+        if self.path:
+            try:
+                with self._lock:
+                    conn = self._connect()
+                    conn.execute(
+                        "INSERT OR REPLACE INTO callback_tokens (token, payload, expires) VALUES (?, ?, ?)",
+                        (token, json.dumps(payload), expires),
+                    )
+                    self._writes += 1
+                    if self._writes % _PURGE_EVERY == 0:
+                        conn.execute("DELETE FROM callback_tokens WHERE expires < ?", (now,))
+                    conn.commit()
+            except sqlite3.Error as e:
+                logger.warning("Callback token saqlanmadi: %s", e)
+        return token
+
+    def get(self, token: str) -> dict | None:
+        """Payload for token, or None if it is unknown or expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+        if entry is not None:
+            return entry[0] if entry[1] > now else None
+        if not self.path:
+            return None
+        try:
+            with self._lock:
+                row = self._connect().execute(
+                    "SELECT payload, expires FROM callback_tokens WHERE token = ?", (token,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Callback token o'qilmadi: %s", e)
+            return None
+        if not row or row[1] <= now:
+            return None
+        return json.loads(row[0])
+
+    def _evict(self, now: float) -> None:
+        # Hamma yozuvlarning TTL'i bir xil — eng eskisi har doim boshida
+        while self._entries:
+            token, (_, expires) = next(iter(self._entries.items()))
+            if expires > now and len(self._entries) <= self.max_memory:
+                break
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+callback_store = CallbackStore()
@@ -0,0 +1,35 @@
+import os
+import threading
+
+
+class CancelHook:
+    """yt-dlp progress hook that aborts a download once ``event`` is set.
+
+    It also remembers every file the download touched, so cleanup() can remove
+    partial (.part/.ytdl) and finished files after a cancel or failure.
+    """
+
+    def __init__(self, event: threading.Event | None = None):
+        self.event = event
+        self.files: set[str] = set()
+
+    def check(self) -> None:
+        if self.event is not None and self.event.is_set():
+            # yt_dlp'ni import vaqtida yuklamaymiz (qarang: ydl_pool)
+            from yt_dlp.utils import DownloadCancelled
+
+            raise DownloadCancelled("download cancelled by caller")
+
+    def __call__(self, status: dict) -> None:
+        for field in ("tmpfilename", "filename"):
+            if status.get(field):
+                self.files.add(status[field])
+        self.check()
+
+    def cleanup(self) -> None:
+        for path in self.files:
+            for candidate in (path, path + ".part", path + ".ytdl"):
+                try:
+                    os.remove(candidate)
+                except OSError:
+                    pass
@@ -0,0 +1,193 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# Bitta fayl uchun parallel HTTP ulanishlar (1 — o'chirilgan, yt-dlp o'zi yuklaydi)
+DOWNLOAD_CONNECTIONS = int(os.environ.get("DOWNLOAD_CONNECTIONS", "4"))
+# Shundan kichik fayllar bitta ulanishda tezroq tugaydi
+CHUNKED_MIN_MB = float(os.environ.get("CHUNKED_MIN_MB", "5"))
+DOWNLOAD_CHUNK_MB = float(os.environ.get("DOWNLOAD_CHUNK_MB", "4"))
+CHUNK_RETRIES = int(os.environ.get("CHUNK_RETRIES", "3"))
+CHUNK_TIMEOUT = float(os.environ.get("CHUNK_TIMEOUT", "20"))
+
+_BLOCK = 256 * 1024
+
+CHUNK_RETRY_TOTAL = Counter("bot_download_chunk_retries_total", "Range requests retried by the chunked downloader")
+
+
+class ChunkError(Exception):
+    """A range request returned something other than the requested bytes."""
+
+
+def _probe_size(url: str, headers: dict) -> int | None:
+    """Total size from a one-byte range request; None if the server ignores ranges."""
+    # requests faqat birinchi yuklashda import qilinadi (ishga tushish vaqti uchun)
+    import requests
+
+    try:
+        with requests.get(url, headers={**headers, "Range": "bytes=0-0"}, stream=True, timeout=CHUNK_TIMEOUT) as r:
+            content_range = r.headers.get("Content-Range", "")
+            if r.status_code != 206 or "/" not in content_range:
+                return None
+            total = content_range.rsplit("/", 1)[1]
+            return int(total) if total.isdigit() else None
+    except requests.RequestException as e:
+        logger.info("Range so'rovi bajarilmadi: %s", e)
+        return None
+
+
+def _preallocate(path: str, size: int) -> None:
+    with open(path, "wb") as f:
+        if hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+                return
+            except OSError:
+                pass
+        f.truncate(size)
+
+
+class _Transfer:
+    """Shared state of one chunked download: pending ranges, progress and the stop flag."""
+
+    def __init__(self, url: str, headers: dict, tmp: str, size: int, progress_hook, filename: str):
+        self.url = url
+        self.headers = headers
+        self.tmp = tmp
+        self.size = size
+        self.progress_hook = progress_hook
+        self.filename = filename
+        chunk = max(_BLOCK, int(DOWNLOAD_CHUNK_MB * 1024 * 1024))
+        self.ranges = deque((start, min(start + chunk, size) - 1) for start in range(0, size, chunk))
+        self.downloaded = 0
+        self.stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def _advance(self, count: int) -> None:
+        with self._lock:
+            self.downloaded += count
+            downloaded = self.downloaded
+        if self.progress_hook:
+            # CancelHook: bekor qilinsa shu yerda DownloadCancelled ko'tariladi
+            self.progress_hook({
+                "status": "downloading", "filename": self.filename, "tmpfilename": self.tmp,
+                "downloaded_bytes": downloaded, "total_bytes": self.size,
+            })
+
+    def work(self) -> None:
+        """Connection thread: take ranges off the shared queue until it is empty."""
+        import requests
+
+        with requests.Session() as session, open(self.tmp, "r+b") as out:
+            while not self.stop.is_set():
+                try:
+                    start, end = self.ranges.popleft()
+                except IndexError:
+                    return
+                self._fetch(session, out, start, end)
+
+    def _fetch(self, session, out, start: int, end: int) -> None:
+        import requests
+
+        pos = start
+        for attempt in range(CHUNK_RETRIES + 1):
+            try:
+                # Qayta urinishda faqat yetishmagan qismi so'raladi
+                with session.get(self.url, headers={**self.headers, "Range": f"bytes={pos}-{end}"},
+                                 stream=True, timeout=CHUNK_TIMEOUT) as r:
+                    if r.status_code != 206:
+                        raise ChunkError(f"HTTP {r.status_code} for bytes {pos}-{end}")
+                    out.seek(pos)
+                    for block in r.iter_content(_BLOCK):
+                        if self.stop.is_set():
+                            return
+                        block = block[:end + 1 - pos]
+                        out.write(block)
+                        pos += len(block)
+                        self._advance(len(block))
+                        if pos > end:
+                            return
+                raise ChunkError(f"connection closed at byte {pos} of {start}-{end}")
+            except (requests.RequestException, ChunkError) as e:
+                if attempt >= CHUNK_RETRIES or self.stop.is_set():
+                    raise
+                CHUNK_RETRY_TOTAL.inc()
+                logger.info("Bo'lak qayta so'ralmoqda (%d/%d): %s", attempt + 1, CHUNK_RETRIES, e)
+                time.sleep(min(0.5 * 2 ** attempt, 4))
+
+
+def fetch_ranges(url: str, filename: str, headers: dict | None = None, progress_hook=None,
+                 connections: int = DOWNLOAD_CONNECTIONS) -> bool:
+    """Download url into filename over several concurrent range requests.
+
+    The file is preallocated as ``filename + '.part'``, every connection
+    writes its ranges in place, and the part file is renamed once all bytes
+    are there. Returns False (nothing written) when the size is unknown or
+    the server does not honour ranges, so the caller can fall back.
+    """
+    headers = dict(headers or {})
+    size = _probe_size(url, headers)
+    if not size:
+        return False
+    tmp = filename + ".part"
+    transfer = _Transfer(url, headers, tmp, size, progress_hook, filename)
+    workers = max(1, min(connections, len(transfer.ranges)))
+    started = time.monotonic()
+    try:
+        _preallocate(tmp, size)
+        with ThreadPoolExecutor(workers, thread_name_prefix="chunk") as pool:
+            futures = [pool.submit(transfer.work) for _ in range(workers)]
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            failed = next((f for f in done if f.exception() is not None), None)
+            if failed is not None:
+                # Qolgan ulanishlar ham to'xtasin
+                transfer.stop.set()
+                raise failed.exception()
+        if transfer.downloaded != size:
+            raise ChunkError(f"got {transfer.downloaded} of {size} bytes")
+        os.replace(tmp, filename)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    logger.info("Chunked yuklash: %.1f MB, %d ulanish, %.1f s", size / (1024 * 1024), workers,
+                time.monotonic() - started)
+    return True
+
+
+def _suitable(info: dict) -> bool:
+    if DOWNLOAD_CONNECTIONS <= 1 or info.get("requested_formats") or not info.get("url"):
+        return False
+    if info.get("protocol") not in ("http", "https"):
+        return False
+    size = info.get("filesize") or info.get("filesize_approx")
+    return size is None or size >= CHUNKED_MIN_MB * 1024 * 1024
+
+
+def download(ydl, url: str, progress_hook=None) -> str:
+    """Drop-in for ``ydl.extract_info(url, download=True)`` that returns the file path.
+
+    A single direct HTTP(S) format is fetched with fetch_ranges; merged
+    formats, DASH/HLS (yt-dlp downloads their fragments concurrently via
+    concurrent_fragment_downloads) and servers without range support use
+    yt-dlp's own downloader.
+    """
+    info = ydl.extract_info(url, download=False)
+    if info.get("_type", "video") != "video":
+        info = ydl.extract_info(url, download=True)
+        downloads = info.get("requested_downloads") or [{}]
+        return downloads[0].get("filepath") or ydl.prepare_filename(info)
+    filename = ydl.prepare_filename(info)
+    if _suitable(info) and fetch_ranges(info["url"], filename, info.get("http_headers"), progress_hook):
+        return filename
+    ydl.process_info(info)
+    return info.get("filepath") or filename
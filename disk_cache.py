@@ -0,0 +1,213 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from metrics import Gauge
+from workers import BOT_WORKERS
+
+logger = logging.getLogger(__name__)
+
+DOWNLOADS_DIR = "downloads"
+# Har bir worker jarayoni o'z kesh papkasini oladi: indeks, byudjet va pin'lar jarayon ichida
+CACHE_DIR = os.environ.get("DISK_CACHE_DIR", os.path.join(DOWNLOADS_DIR, "cache"))
+# Yuklanayotgan (hali keshga ko'chirilmagan) fayllar papkasi; har bir worker jarayoni o'zinikini oladi
+SCRATCH_DIR = os.environ.get("DOWNLOAD_SCRATCH_DIR", DOWNLOADS_DIR)
+# Kesh uchun umumiy disk byudjeti (0 — keshni o'chiradi), worker'lar orasida teng bo'linadi, va eskirgan fayllar yoshi
+DISK_CACHE_MB = int(os.environ.get("DISK_CACHE_MB", "1024")) // max(1, BOT_WORKERS)
+DISK_CACHE_MAX_AGE = float(os.environ.get("DISK_CACHE_MAX_AGE_HOURS", "72")) * 3600
+
+_PARTIAL_SUFFIXES = (".part", ".ytdl", ".tmp")
+_SAFE_KEY_RE = re.compile(r"^[A-Za-z0-9_:.-]+$")
+# Bu vaqtdan oldin yozilgan vaqtinchalik fayllar — oldingi jarayondan qolgan yetim fayllar
+_PROCESS_STARTED = time.time()
+
+
+def _stem(key: str) -> str:
+    """Deterministic file name stem for a cache key ('yt:<id>:audio' -> 'yt~<id>~audio')."""
+    if _SAFE_KEY_RE.match(key) and len(key) <= 120:
+        return key.replace(":", "~")
+    return "h~" + hashlib.sha1(key.encode()).hexdigest()
+
+
+class DiskCache:
+    """Byte-budget LRU cache of downloaded media under downloads/cache/.
+
+    Finished downloads are moved in with os.replace (atomic on one
+    filesystem), so the cache never contains partial files. The file name is
+    derived from the key, which lets sweep() rebuild the index from disk after
+    a restart. Pinned entries (files being uploaded) are never evicted.
+    """
+
+    def __init__(self, root: str = CACHE_DIR, budget_bytes: int = DISK_CACHE_MB * 1024 * 1024,
+                 max_age: float = DISK_CACHE_MAX_AGE):
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[str, int]] = OrderedDict()
+        self._pins: Counter = Counter()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget_bytes > 0
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size
+
+    def get(self, key: str) -> str | None:
+        """Path of the cached file for key (marks it recently used), or None."""
+        stem = _stem(key)
+        with self._lock:
+            entry = self._entries.get(stem)
+            if entry and not os.path.exists(entry[0]):
+                self._drop(stem)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(stem)
+            self.hits += 1
+        try:
+            os.utime(entry[0])
+        except OSError:
+            pass
+        return entry[0]
+
+    def put(self, key: str, src_path: str) -> str:
+        """Move a finished download into the cache and return its new path."""
+        if not self.enabled or not src_path or not os.path.exists(src_path):
+            return src_path
+        os.makedirs(self.root, exist_ok=True)
+        stem = _stem(key)
+        dest = os.path.join(self.root, stem + os.path.splitext(src_path)[1])
+        if os.path.abspath(src_path) != os.path.abspath(dest):
+            os.replace(src_path, dest)
+        # yt-dlp mtime'ni serverdagi Last-Modified'ga qo'yadi; yosh va LRU keshga tushgan paytdan hisoblansin
+        os.utime(dest)
+        size = os.path.getsize(dest)
+        with self._lock:
+            old = self._entries.get(stem)
+            if old and old[0] != dest:
+                self._remove_file(old[0])
+            self._drop(stem)
+            self._entries[stem] = (dest, size)
+            self._size += size
+            self._evict()
+        return dest
+
+    def pin(self, key: str) -> None:
+        with self._lock:
+            self._pins[_stem(key)] += 1
+
+    def unpin(self, key: str) -> None:
+        with self._lock:
+            stem = _stem(key)
+            self._pins[stem] -= 1
+            if self._pins[stem] <= 0:
+                del self._pins[stem]
+            self._evict()
+
+    def discard(self, key: str) -> None:
+        """Drop an entry nobody asked for (e.g. an unused prefetch) unless it is pinned."""
+        stem = _stem(key)
+        with self._lock:
+            entry = self._entries.get(stem)
+            if entry is None or self._pins.get(stem):
+                return
+            self._drop(stem)
+            self._remove_file(entry[0])
+
+    @staticmethod
+    def sweep_scratch() -> int:
+        """Delete files left in the scratch folder by a previous process; returns how many.
+
+        Must run before any download starts: yt-dlp sets a finished file's
+        mtime from the server's Last-Modified, so a fresh download would look
+        orphaned too.
+        """
+        removed = 0
+        if os.path.isdir(SCRATCH_DIR):
+            for name in os.listdir(SCRATCH_DIR):
+                path = os.path.join(SCRATCH_DIR, name)
+                # Scratch papkadagi fayllar — vaqtinchalik; jarayon boshlanishidan oldingilari yetim
+                if os.path.isfile(path) and os.path.getmtime(path) < _PROCESS_STARTED:
+                    removed += DiskCache._remove_file(path)
+        if removed:
+            logger.info("Scratch papkadan %d yetim fayl o'chirildi", removed)
+        return removed
+
+    def sweep(self) -> None:
+        """Startup sweep of the cache folder: drop partial and stale files, rebuild the index.
+
+        Safe to run in the background while the bot serves requests; the
+        scratch folder is handled by sweep_scratch() before that.
+        """
+        removed = 0
+        found = []
+        if os.path.isdir(self.root):
+            now = time.time()
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                if not os.path.isfile(path):
+                    continue
+                mtime = os.path.getmtime(path)
+                if name.endswith(_PARTIAL_SUFFIXES) or now - mtime > self.max_age or not self.enabled:
+                    removed += self._remove_file(path)
+                    continue
+                found.append((mtime, os.path.splitext(name)[0], path, os.path.getsize(path)))
+        with self._lock:
+            # Eng yangisidan boshlab har birini boshiga qo'yamiz: eng eskisi birinchi chiqariladi
+            for _, stem, path, size in sorted(found, reverse=True):
+                if stem not in self._entries:
+                    self._entries[stem] = (path, size)
+                    self._size += size
+                    self._entries.move_to_end(stem, last=False)
+            self._evict()
+        logger.info("Disk cache: %d fayl (%.1f MB), %d yetim fayl o'chirildi",
+                    len(self._entries), self._size / (1024 * 1024), removed)
+
+    def _evict(self) -> None:
+        if self._size <= self.budget_bytes:
+            return
+        for stem in list(self._entries):
+            if self._size <= self.budget_bytes:
+                break
+            if self._pins.get(stem):
+                continue
+            path, _ = self._entries[stem]
+            self._drop(stem)
+            self._remove_file(path)
+
+    def _drop(self, stem: str) -> None:
+        entry = self._entries.pop(stem, None)
+        if entry:
+            self._size -= entry[1]
+
+    @staticmethod
+    def _remove_file(path: str) -> int:
+        try:
+            os.remove(path)
+            return 1
+        except OSError:
+            return 0
+
+    def stats(self) -> dict:
+        return {
+            "files": len(self._entries),
+            "bytes": self._size,
+            "budget_bytes": self.budget_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+disk_cache = DiskCache()
+Gauge("bot_disk_cache_bytes", "Bytes held in the downloads/ disk cache", lambda: disk_cache.size_bytes)
@@ -0,0 +1,95 @@
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Telegram bot API yuklash chegarasi (50MB) — biroz zaxira bilan
+MAX_UPLOAD_MB = int(os.environ.get("MAX_UPLOAD_MB", "49"))
+MAX_UPLOAD_BYTES = MAX_UPLOAD_MB * 1024 * 1024
+# yt-dlp va transcode uchun ffmpeg: nomi (PATH'dan), binar fayl yoki ffmpeg/ffprobe turgan papka
+FFMPEG_LOCATION = os.environ.get("FFMPEG_LOCATION", "ffmpeg")
+
+
+def ffmpeg_tool(name: str = "ffmpeg") -> str:
+    """Path of ffmpeg/ffprobe next to FFMPEG_LOCATION (a binary, a directory or a bare name)."""
+    if os.path.isdir(FFMPEG_LOCATION):
+        return os.path.join(FFMPEG_LOCATION, name)
+    directory, binary = os.path.split(FFMPEG_LOCATION)
+    return os.path.join(directory, binary.replace("ffmpeg", name)) if directory else binary.replace("ffmpeg", name)
+
+
+def format_size(fmt: dict) -> int | None:
+    """Exact or estimated size in bytes (yt-dlp fills filesize_approx from tbr x duration)."""
+    return fmt.get('filesize') or fmt.get('filesize_approx')
+
+
+def _pick(tiers: list[list[dict]], limit: int) -> dict | None:
+    """Best format of the first tier that has one fitting under limit.
+
+    Formats come sorted worst -> best from yt-dlp. Unknown sizes count as
+    fitting. If nothing fits, the best format of the first non-empty tier is
+    returned so the caller still gets a file (and reports it as too large).
+    """
+    for tier in tiers:
+        for fmt in reversed(tier):
+            size = format_size(fmt)
+            if size is None or size <= limit:
+                return fmt
+    for tier in tiers:
+        if tier:
+            return tier[-1]
+    return None
+
+
+def _has_audio(fmt: dict) -> bool:
+    """Audio is present or unknown; storyboards (no audio, no video) and video-only streams are not."""
+    return fmt.get('acodec') != 'none'
+
+
+def _log_choice(kind: str, fmt: dict, formats: list[dict]) -> None:
+    size = format_size(fmt)
+    if formats and fmt is not formats[-1]:
+        logger.info("%s format %s tanlandi (~%.1f MB, %s kbps) — hajm chegarasi uchun",
+                    kind, fmt.get('format_id'), (size or 0) / (1024 * 1024), fmt.get('tbr') or fmt.get('abr'))
+
+
+def select_audio_format(ctx: dict):
+    """yt-dlp format selector: best AAC/M4A audio under MAX_UPLOAD_BYTES.
+
+    Replaces 'bestaudio[acodec^=mp4a]/bestaudio[ext=m4a]/bestaudio/best' and
+    falls back to a lower bitrate (or another codec) instead of downloading a
+    file Telegram would reject. Only formats with audio are considered; if
+    none fits, the best audio is returned and the transcoder (or the "too
+    large" reply) deals with it.
+    """
+    formats = ctx['formats']
+    with_audio = [f for f in formats if _has_audio(f)]
+    audio_only = [f for f in with_audio if f.get('vcodec') == 'none']
+    tiers = [
+        [f for f in audio_only if (f.get('acodec') or '').startswith('mp4a')],
+        [f for f in audio_only if f.get('ext') == 'm4a'],
+        audio_only,
+        with_audio,
+    ]
+    fmt = _pick(tiers, MAX_UPLOAD_BYTES)
+    if fmt:
+        _log_choice("Audio", fmt, audio_only or with_audio)
+        yield fmt
+
+
+def select_video_format(ctx: dict):
+    """yt-dlp format selector: best combined MP4 under MAX_UPLOAD_BYTES ('best[ext=mp4]/best').
+
+    Silent video-only streams and storyboards are never picked; if no
+    combined format fits, the best one is returned and reported as too large.
+    """
+    formats = ctx['formats']
+    combined = [f for f in formats if f.get('vcodec') != 'none' and _has_audio(f)]
+    tiers = [
+        [f for f in combined if f.get('ext') == 'mp4'],
+        combined,
+    ]
+    fmt = _pick(tiers, MAX_UPLOAD_BYTES)
+    if fmt:
+        _log_choice("Video", fmt, combined)
+        yield fmt
@@ -1,43 +1,140 @@
 import logging
 import os
 import asyncio
-import hashlib
-import time
+from functools import partial
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes
-from youtube import search_youtube, download_from_youtube, search_top_video_id
-from instagram import download_from_instagram, download_instagram_video, get_instagram_caption
+from youtube import (search_youtube, download_from_youtube, download_preview, search_top_video_id, extract_video_id,
+                     PREVIEW_SECONDS, PREVIEW_TIMEOUT)
+from instagram import (download_from_instagram, download_instagram_video, get_instagram_caption, extract_media_id,
+                       canonical_url, clean_caption)
+from media_cache import file_id_cache, ig_index, media_key
+from callback_store import callback_store
+from prefetch import prefetcher
+from batch import collect_batch, send_batch
+from singleflight import downloads
+from scheduler import QueueFull, PRIORITY_BUTTON
+from formats import MAX_UPLOAD_MB
+from readiness import readiness
+from metrics import timer, timed, OUTCOMES, IG_RACE_WINNER, BYTES_UPLOADED
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-# In-memory map for short Instagram audio tokens -> original URL
-IG_AUDIO_MAP: dict[str, dict] = {}
-
-def _prune_ig_audio_map(max_age: int = 600, max_size: int = 500) -> None:
-    """Prune expired or excessive callback entries to keep memory bounded."""
-    now = time.time()
-    # Remove old entries
-    for k, v in list(IG_AUDIO_MAP.items()):
-        if now - v.get("ts", now) > max_age:
-            IG_AUDIO_MAP.pop(k, None)
-    # Bound size
-    if len(IG_AUDIO_MAP) > max_size:
-        items = sorted(IG_AUDIO_MAP.items(), key=lambda kv: kv[1].get("ts", 0))
-        for k, _ in items[: len(IG_AUDIO_MAP) - max_size]:
-            IG_AUDIO_MAP.pop(k, None)
-
-def _store_ig_audio_url(url: str) -> str:
-    """Store URL and return a short token for Telegram callback_data (<=64 bytes)."""
-    token = hashlib.sha256(url.encode()).hexdigest()[:32]
-    IG_AUDIO_MAP[token] = {"url": url, "ts": time.time()}
-    _prune_ig_audio_map()
-    return token
-
-def _get_ig_audio_url(token: str) -> str | None:
-    """Retrieve original Instagram URL for a given token."""
-    entry = IG_AUDIO_MAP.get(token)
-    return entry["url"] if entry else None
+TOO_LARGE_TEXT = "🚫 Fayl juda katta (>49MB). Qisqaroq trek tanlang yoki boshqa natijani sinab ko'ring."
+QUEUE_FULL_TEXT = "🚦 Hozir yuklashlar navbati to'la. Iltimos, birozdan so'ng qayta urinib ko'ring."
+
+async def _send_cached(send, key: str | None, **kwargs) -> bool:
+    """Resend an already uploaded file by its file_id. Returns False on a cache miss."""
+    file_id = file_id_cache.get(key)
+    if not file_id:
+        return False
+    try:
+        await send(file_id, **kwargs)
+    except BadRequest as e:
+        # file_id eskirgan bo'lishi mumkin — keshdan o'chirib, oddiy yo'l bilan yuklaymiz
+        logger.warning("Cached file_id rad etildi (%s): %s", key, e)
+        file_id_cache.forget(key)
+        return False
+    logger.info("file_id cache hit: %s", key)
+    OUTCOMES.inc(outcome="cache_hit")
+    return True
+
+def _remember_file_id(key: str | None, message) -> None:
+    """Store the file_id of an uploaded audio/video message for later resends."""
+    media = (
+        getattr(message, "audio", None)
+        or getattr(message, "video", None)
+        or getattr(message, "voice", None)
+        or getattr(message, "document", None)
+    )
+    if media:
+        file_id_cache.put(key, media.file_id)
+
+def _is_too_large(path: str) -> bool:
+    """True if the file exceeds the Telegram upload limit (unknown size counts as OK)."""
+    with timer("size_check"):
+        try:
+            too_large = os.path.getsize(path) / (1024 * 1024) > MAX_UPLOAD_MB
+        except Exception:
+            return False
+    if too_large:
+        OUTCOMES.inc(outcome="too_large")
+    return too_large
+
+async def _upload(send, path: str, key: str | None, **kwargs):
+    """Upload a downloaded file and remember the returned file_id."""
+    with timer("upload"), open(path, 'rb') as media_file:
+        sent = await send(media_file, **kwargs)
+    try:
+        BYTES_UPLOADED.inc(os.path.getsize(path))
+    except OSError:
+        pass
+    OUTCOMES.inc(outcome="ok")
+    _remember_file_id(key, sent)
+    return sent
+
+async def _edit_status(query, text: str) -> None:
+    """Show a status line on a button's message: the caption of media messages, the text otherwise."""
+    message = query.message
+    if getattr(message, 'video', None) or getattr(message, 'voice', None) or getattr(message, 'audio', None):
+        await query.edit_message_caption(caption=text)
+    else:
+        await query.edit_message_text(text=text)
+
+async def _send_preview(message, video_id: str, title: str | None, search_query: str, user_id) -> bool:
+    """Send the first PREVIEW_SECONDS of a track as a voice clip with a "full track" button.
+
+    Returns False if no preview could be made in time (or the queue is full), so the caller sends the full track.
+    """
+    token = callback_store.put({"video_id": video_id, "title": title, "query": search_query})
+    options = {
+        "caption": f"🎧 {title or video_id}\n{PREVIEW_SECONDS} soniyalik parcha",
+        "reply_markup": InlineKeyboardMarkup(
+            [[InlineKeyboardButton("⬇️ To'liq trekni yuklash", callback_data=f"yt:{token}")]]
+        ),
+    }
+    preview_key = media_key("yt", video_id, "preview")
+    if await _send_cached(message.reply_voice, preview_key, **options):
+        return True
+    try:
+        lease = await downloads.acquire(preview_key, download_preview, video_id, timeout=PREVIEW_TIMEOUT + 5,
+                                        user_id=user_id, priority=PRIORITY_BUTTON)
+    except QueueFull:
+        # Navbat to'la — parchasiz, to'g'ridan-to'g'ri to'liq trek yo'liga o'tamiz
+        logger.info("Navbat to'la — parcha o'tkazib yuborildi (%s)", video_id)
+        return False
+    except Exception as e:
+        logger.warning("Parcha tayyorlanmadi (%s): %s", video_id, e)
+        return False
+    with lease:
+        try:
+            await _upload(message.reply_voice, lease.path, preview_key, **options)
+        except BadRequest as e:
+            # Masalan, foydalanuvchi ovozli xabarlarni taqiqlagan — to'liq trek baribir yuborilsin
+            logger.warning("Parcha yuborilmadi (%s): %s", video_id, e)
+            return False
+    return True
+
+def _queue_notice(message):
+    """on_queued callback for the download scheduler: tell the user their position."""
+    async def notify(position: int) -> None:
+        await message.reply_text(f"🚦 Navbatdasiz: {position}-o'rin. Yuklash tez orada boshlanadi.")
+    return notify
+
+def _transcode_notice(send):
+    """on_postprocess callback for downloads: say that an oversized file is being re-encoded."""
+    async def notify() -> None:
+        await send("🎚️ Fayl Telegram uchun juda katta — siqilmoqda, biroz kuting...")
+    return notify
+
+def _discard(task: asyncio.Task) -> None:
+    """Cancel a race task we no longer need, or release the lease it already won."""
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled() and task.exception() is None:
+        task.result().release()
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Sends a message when the command /start is issued."""
@@ -54,136 +151,180 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def ping(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Oddiy jonlilik testi: /ping -> pong"""
-    await update.message.reply_text("pong")
+    # Ishga tushish tugamagan bo'lsa ham darhol javob beramiz, faqat holatini aytamiz
+    await update.message.reply_text("pong" if readiness.is_ready else "pong (ishga tushmoqda...)")
 
+@timed("handler", handler="search_song")
 async def search_song(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Searches for songs and shows them as buttons or downloads directly from a link."""
     search_query = update.message.text
+    user_id = update.effective_user.id if update.effective_user else None
     logger.info(f"Search query: {search_query}")
     await update.message.reply_text("Qidirilmoqda...")
 
     try:
+        # Pleylist yoki bir nechta havola — albomlar bilan yuboramiz
+        batch = await collect_batch(search_query)
+        if batch:
+            await send_batch(update.message, batch, user_id=user_id)
+            return
+
         if "instagram.com" in search_query:
             # Tezlik uchun parallel: video (≤20s), IG audio (≤40s), YouTube audio (≤30s) — qaysi tez tugasa, shuni yuboramiz
-            token = _store_ig_audio_url(search_query)
+            # Bitta post turli havolalar bilan ulashiladi (?igsh=..., /reel/ va /p/) — bitta kalitga keltiramiz
+            url = canonical_url(search_query) or search_query
+            token = callback_store.put({"url": url})
             keyboard = InlineKeyboardMarkup(
                 [[InlineKeyboardButton("🎵 Qo'shiqni yuklash", callback_data=f"ig_audio:{token}")]]
             )
+            ig_id = extract_media_id(search_query) or search_query
+            video_key = media_key("ig", ig_id, "video")
+            audio_key = media_key("ig", ig_id, "audio")
+            known = ig_index.get(url) or {}
 
-            async def yt_audio_from_ig(url: str):
+            # Avval yuborilgan bo'lsa — yuklamasdan file_id orqali qayta yuboramiz
+            cached_video = file_id_cache.get(video_key)
+            # file_id qaysi kalitdan olingan bo'lsa, rad etilganda o'shani unutamiz (IG yoki YouTube audio)
+            cached_audio_key = audio_key
+            cached_audio = file_id_cache.get(audio_key)
+            if not cached_audio and known.get("youtube_id"):
+                cached_audio_key = media_key("yt", known["youtube_id"], "audio")
+                cached_audio = file_id_cache.get(cached_audio_key)
+            video_sent = False
+            if cached_video and cached_audio:
+                try:
+                    await update.message.reply_video(video=cached_video, caption="Instagram video", reply_markup=keyboard)
+                    video_sent = True
+                except BadRequest as e:
+                    logger.warning("Cached Instagram video rad etildi (%s): %s", ig_id, e)
+                    file_id_cache.forget(video_key)
+            if cached_audio:
+                # Audio ma'lum — poygasiz: audio darhol, keyin (kerak bo'lsa) faqat video yuklanadi
                 try:
-                    caption = await asyncio.wait_for(asyncio.to_thread(get_instagram_caption, url), timeout=8)
+                    await update.message.reply_audio(audio=cached_audio)
+                except BadRequest as e:
+                    logger.warning("Cached Instagram audio rad etildi (%s): %s", ig_id, e)
+                    file_id_cache.forget(cached_audio_key)
+                else:
+                    OUTCOMES.inc(outcome="cache_hit")
+                    if video_sent:
+                        return
+                    # Audio yetkazildi — video muvaffaqiyatsiz bo'lsa, foydalanuvchiga xato ko'rsatmaymiz
+                    try:
+                        with await downloads.acquire(video_key, download_instagram_video, url,
+                                                     timeout=20, user_id=user_id) as lease:
+                            await _upload(update.message.reply_video, lease.path, video_key,
+                                          caption="Instagram video", reply_markup=keyboard)
+                    except asyncio.TimeoutError:
+                        OUTCOMES.inc(outcome="timeout")
+                    except Exception as e:
+                        logger.info("Instagram video yuborilmadi (%s): %s", ig_id, e)
+                    return
+
+            async def yt_audio_from_ig(url: str):
+                video_id = known.get("youtube_id")
+                if not video_id:
+                    caption = known.get("caption") or await asyncio.wait_for(
+                        asyncio.to_thread(get_instagram_caption, url), timeout=8
+                    )
                     if not caption:
                         raise RuntimeError("caption_not_found")
-                    video_id, _ = await asyncio.wait_for(asyncio.to_thread(search_top_video_id, caption), timeout=12)
+                    query = clean_caption(caption) or caption
+                    video_id, _ = await asyncio.wait_for(asyncio.to_thread(search_top_video_id, query), timeout=12)
+                    ig_index.put(url, shortcode=extract_media_id(url), caption=caption, query=query,
+                                 youtube_id=video_id)
                     if not video_id:
                         raise RuntimeError("yt_id_not_found")
-                    return await asyncio.wait_for(asyncio.to_thread(download_from_youtube, video_id), timeout=10)
+                return await downloads.acquire(
+                    media_key("yt", video_id, "audio"), download_from_youtube, video_id,
+                    timeout=10, user_id=user_id,
+                )
+
+            async def send_video(task: asyncio.Task | None) -> None:
+                if task is None:
+                    return
+                try:
+                    with await task as lease:
+                        await _upload(update.message.reply_video, lease.path, video_key,
+                                      caption="Instagram video", reply_markup=keyboard)
                 except Exception:
-                    raise
+                    pass
 
-            video_task = asyncio.create_task(
-                asyncio.wait_for(asyncio.to_thread(download_instagram_video, search_query), timeout=20)
+            async def send_audio(task: asyncio.Task) -> bool:
+                """Send the audio a race task produced; False if it was too large."""
+                try:
+                    with await task as lease:
+                        if _is_too_large(lease.path):
+                            await update.message.reply_text(TOO_LARGE_TEXT)
+                            return False
+                        await _upload(update.message.reply_audio, lease.path, audio_key)
+                except Exception:
+                    pass
+                return True
+
+            # Video allaqachon yuborilgan bo'lsa (faqat audio file_id eskirgan) — faqat audio poygasi
+            video_task = None if video_sent else asyncio.create_task(
+                downloads.acquire(video_key, download_instagram_video, url, timeout=20, user_id=user_id)
             )
             ig_audio_task = asyncio.create_task(
-                asyncio.wait_for(asyncio.to_thread(download_from_instagram, search_query), timeout=40)
+                downloads.acquire(audio_key, download_from_instagram, url, timeout=40, user_id=user_id)
             )
-            yt_audio_task = asyncio.create_task(yt_audio_from_ig(search_query))
+            yt_audio_task = asyncio.create_task(yt_audio_from_ig(url))
 
-            done, pending = await asyncio.wait({video_task, ig_audio_task, yt_audio_task}, return_when=asyncio.FIRST_COMPLETED)
+            racers = {t for t in (video_task, ig_audio_task, yt_audio_task) if t is not None}
+            done, pending = await asyncio.wait(racers, return_when=asyncio.FIRST_COMPLETED)
+            for t, branch in [(video_task, "video"), (ig_audio_task, "ig_audio"), (yt_audio_task, "yt_audio")]:
+                # Xato bilan tugagan tarmoq g'olib emas
+                if t in done and not t.cancelled() and t.exception() is None:
+                    IG_RACE_WINNER.inc(branch=branch)
 
-            if video_task in done and not video_task.cancelled():
-                try:
-                    video_path = video_task.result()
-                    try:
-                        with open(video_path, 'rb') as vf:
-                            await update.message.reply_video(video=vf, caption="Instagram video", reply_markup=keyboard)
-                    finally:
-                        try:
-                            os.remove(video_path)
-                        except Exception:
-                            pass
-                except Exception:
-                    pass
+            if video_task in done:
+                await send_video(video_task)
                 # Optionally, send audio later if available
                 for t in [ig_audio_task, yt_audio_task]:
-                    try:
-                        new_filename = await t
-                        if new_filename:
-                            try:
-                                size_mb = os.path.getsize(new_filename) / (1024 * 1024)
-                                if size_mb > 49:
-                                    await update.message.reply_text("🚫 Fayl juda katta (>49MB). Qisqaroq trek tanlang yoki boshqa natijani sinab ko'ring.")
-                                    os.remove(new_filename)
-                                    continue
-                            except Exception:
-                                pass
-                            with open(new_filename, 'rb') as audio_file:
-                                await update.message.reply_audio(audio=audio_file)
-                            os.remove(new_filename)
-                    except Exception:
-                        pass
+                    await send_audio(t)
                 return
 
             # If audio (IG or YT) finishes first, send it immediately; then try to send video if it eventually arrives
-            for t in [ig_audio_task, yt_audio_task]:
-                if t in done and not t.cancelled():
-                    try:
-                        new_filename = t.result()
-                        try:
-                            size_mb = os.path.getsize(new_filename) / (1024 * 1024)
-                            if size_mb > 49:
-                                await update.message.reply_text("🚫 Fayl juda katta (>49MB). Qisqaroq trek tanlang yoki boshqa natijani sinab ko'ring.")
-                                os.remove(new_filename)
-                                break
-                        except Exception:
-                            pass
-                        with open(new_filename, 'rb') as audio_file:
-                            await update.message.reply_audio(audio=audio_file)
-                        os.remove(new_filename)
-                    except Exception:
-                        pass
+            for t, other in [(ig_audio_task, yt_audio_task), (yt_audio_task, ig_audio_task)]:
+                if t in done:
+                    _discard(other)
+                    if not await send_audio(t):
+                        if video_task is not None:
+                            _discard(video_task)
+                        return
                     # Try to send video afterwards with button when available
-                    try:
-                        video_path = await video_task
-                        try:
-                            with open(video_path, 'rb') as vf:
-                                await update.message.reply_video(video=vf, caption="Instagram video", reply_markup=keyboard)
-                        finally:
-                            try:
-                                os.remove(video_path)
-                            except Exception:
-                                pass
-                    except Exception:
-                        pass
+                    await send_video(video_task)
                     return
 
             # None finished quickly — cancel and inform user
             for t in pending:
                 t.cancel()
+            OUTCOMES.inc(outcome="timeout")
             await update.message.reply_text("⏳ Juda sekin tarmoq. Audio/video yuklashni keyinroq qayta urinib ko'ring.")
             return
 
         # YouTube URL bo'lsa — bevosita yuklaymiz
         if ("youtu.be" in search_query) or ("youtube.com" in search_query):
+            video_id = extract_video_id(search_query)
+            audio_key = media_key("yt", video_id, "audio") if video_id else None
+            if await _send_cached(update.message.reply_audio, audio_key):
+                return
             try:
-                new_filename = await asyncio.wait_for(
-                    asyncio.to_thread(download_from_youtube, search_query), timeout=90
+                lease = await downloads.acquire(
+                    audio_key or search_query, download_from_youtube, search_query, timeout=90,
+                    user_id=user_id, on_queued=_queue_notice(update.message),
+                    on_postprocess=_transcode_notice(update.message.reply_text),
                 )
             except asyncio.TimeoutError:
+                OUTCOMES.inc(outcome="timeout")
                 await update.message.reply_text("⏳ YouTube yuklash juda uzoq cho'zildi. Keyinroq urinib ko'ring yoki boshqa havola yuboring.")
                 return
-            try:
-                size_mb = os.path.getsize(new_filename) / (1024 * 1024)
-                if size_mb > 49:
-                    await update.message.reply_text("🚫 Fayl juda katta (>49MB). Qisqaroq trek tanlang yoki boshqa natijani sinab ko'ring.")
-                    os.remove(new_filename)
+            with lease:
+                if _is_too_large(lease.path):
+                    await update.message.reply_text(TOO_LARGE_TEXT)
                     return
-            except Exception:
-                pass
-            with open(new_filename, 'rb') as audio_file:
-                await update.message.reply_audio(audio=audio_file)
-            os.remove(new_filename)
+                await _upload(update.message.reply_audio, lease.path, audio_key)
             return
 
         # Matnli qidiruv: top natijani to'g'ridan-to'g'ri yuklaymiz
@@ -194,26 +335,29 @@ async def search_song(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         except asyncio.TimeoutError:
             video_id, title = None, None
         if video_id:
+            audio_key = media_key("yt", video_id, "audio")
+            if await _send_cached(update.message.reply_audio, audio_key):
+                return
+            # To'liq trek o'rniga avval qisqa parcha: noto'g'ri topilgan qo'shiq uchun o'nlab MB yuklanmaydi
+            if PREVIEW_SECONDS and await _send_preview(update.message, video_id, title, search_query, user_id):
+                return
             if title:
                 await update.message.reply_text(f"Topildi: {title}\nYuklanmoqda... ⏳")
             try:
-                new_filename = await asyncio.wait_for(
-                    asyncio.to_thread(download_from_youtube, video_id), timeout=90
+                lease = await downloads.acquire(
+                    audio_key, download_from_youtube, video_id, timeout=90,
+                    user_id=user_id, on_queued=_queue_notice(update.message),
+                    on_postprocess=_transcode_notice(update.message.reply_text),
                 )
             except asyncio.TimeoutError:
+                OUTCOMES.inc(outcome="timeout")
                 await update.message.reply_text("⏳ Yuklash juda uzoq cho'zildi. Keyinroq urinib ko'ring yoki boshqa natijani sinab ko'ring.")
                 return
-            try:
-                size_mb = os.path.getsize(new_filename) / (1024 * 1024)
-                if size_mb > 49:
-                    await update.message.reply_text("🚫 Fayl juda katta (>49MB). Qisqaroq trek tanlang yoki boshqa natijani sinab ko'ring.")
-                    os.remove(new_filename)
+            with lease:
+                if _is_too_large(lease.path):
+                    await update.message.reply_text(TOO_LARGE_TEXT)
                     return
-            except Exception:
-                pass
-            with open(new_filename, 'rb') as audio_file:
-                await update.message.reply_audio(audio=audio_file)
-            os.remove(new_filename)
+                await _upload(update.message.reply_audio, lease.path, audio_key)
             return
 
         # Fallback: bir nechta variantlarni tugmalar bilan ko'rsatamiz
@@ -227,11 +371,14 @@ async def search_song(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
             keyboard = []
             for entry in results:
                 button_text = f"🎵 {entry['title'][:50]}"
-                callback_data = entry['id']
+                token = callback_store.put({"video_id": entry['id'], "title": entry['title'], "query": search_query})
+                callback_data = f"yt:{token}"
                 keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
 
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await update.message.reply_text('Quyidagilardan birini tanlang:', reply_markup=reply_markup)
+            choices = await update.message.reply_text('Quyidagilardan birini tanlang:', reply_markup=reply_markup)
+            # Foydalanuvchi tanlaguncha birinchi nomzodlarni fon rejimida yuklab turamiz
+            prefetcher.start((choices.chat_id, choices.message_id), [entry['id'] for entry in results])
         else:
             try:
                 await update.message.reply_sticker("CAACAgIAAxkBAAEMD-pmYgWb5gABiR3NB3Uf56n25Zl2qWwAAg4AA_d22A-AAAF0h2aJfrs0BA")
@@ -239,7 +386,11 @@ async def search_song(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
                 pass
             await update.message.reply_text("😔 Kechirasiz, topilmadi yoki tarmoq sekin. Iltimos, YouTube havolasini yuboring yoki yana urinib ko'ring.")
 
+    except QueueFull:
+        OUTCOMES.inc(outcome="queue_full")
+        await update.message.reply_text(QUEUE_FULL_TEXT)
     except Exception as e:
+        OUTCOMES.inc(outcome="error")
         logger.error(f"An error occurred in search_song: {e}", exc_info=True)
         try:
             await update.message.reply_sticker("CAACAgIAAxkBAAEMD-5mYgWvJgABHn5aTzRzFzTqo_mP5fMAAg8AA_d22A-g_NqgABu_AN4NAQ")
@@ -247,50 +398,52 @@ async def search_song(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
             pass
         await update.message.reply_text("🚫 Kechirasiz, qidirish paytida xatolik yuz berdi. Iltimos, birozdan so'ng qayta urinib ko'ring.")
 
+@timed("handler", handler="button")
 async def button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles button presses to download the selected song."""
     query = update.callback_query
     await query.answer()
-    video_id = query.data
     data = query.data
-    
-    # Edit caption if message is a media (video), otherwise edit text
+
+    # Edit caption if message is a media (video/preview), otherwise edit text
     try:
-        if getattr(query.message, 'video', None):
-            await query.edit_message_caption(caption="Yuklanmoqda... ⏳")
-        else:
-            await query.edit_message_text(text="Yuklanmoqda... ⏳")
+        await _edit_status(query, "Yuklanmoqda... ⏳")
     except Exception:
         # If edit fails (e.g., no caption), ignore and proceed
         pass
 
     # Instagram audio callback: download and send quickly, then remove button
     if data.startswith("ig_audio:"):
-        token = data.split(":", 1)[1]
-        url = _get_ig_audio_url(token)
+        payload = callback_store.get(data.split(":", 1)[1])
+        url = payload.get("url") if payload else None
         if not url:
             await query.edit_message_text(text="⏳ Tugma muddati tugagan. Iltimos, linkni qayta yuboring.")
             return
+        ig_id = extract_media_id(url)
+        audio_key = media_key("ig", ig_id, "audio") if ig_id else None
         try:
-            new_filename = await asyncio.wait_for(
-                asyncio.to_thread(download_from_instagram, url), timeout=45
+            if await _send_cached(partial(context.bot.send_audio, query.message.chat.id), audio_key):
+                try:
+                    await query.edit_message_reply_markup(reply_markup=None)
+                except Exception:
+                    pass
+                return
+            lease = await downloads.acquire(
+                audio_key or f"ig:{url}:audio", download_from_instagram, url, timeout=45,
+                user_id=query.from_user.id, priority=PRIORITY_BUTTON,
+                on_postprocess=_transcode_notice(query.edit_message_text),
             )
-            try:
-                size_mb = os.path.getsize(new_filename) / (1024 * 1024)
-                if size_mb > 49:
-                    await query.edit_message_text(text="🚫 Fayl juda katta (>49MB). Qisqaroq trek tanlang yoki boshqa natijani sinab ko'ring.")
-                    os.remove(new_filename)
+            with lease:
+                if _is_too_large(lease.path):
+                    await query.edit_message_text(text=TOO_LARGE_TEXT)
                     return
-            except Exception:
-                pass
-            with open(new_filename, 'rb') as audio_file:
-                await context.bot.send_audio(chat_id=query.message.chat.id, audio=audio_file)
-            os.remove(new_filename)
+                await _upload(partial(context.bot.send_audio, query.message.chat.id), lease.path, audio_key)
             try:
                 await query.edit_message_reply_markup(reply_markup=None)
             except Exception:
                 pass
         except asyncio.TimeoutError:
+            OUTCOMES.inc(outcome="timeout")
             try:
                 if getattr(query.message, 'video', None):
                     await query.edit_message_caption(caption="⏳ Audio yuklash juda uzoq cho'zildi. Keyinroq qayta urinib ko'ring.")
@@ -299,35 +452,67 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             except Exception:
                 pass
             return
+        except QueueFull:
+            OUTCOMES.inc(outcome="queue_full")
+            await query.edit_message_text(text=QUEUE_FULL_TEXT)
         except Exception as e:
+            OUTCOMES.inc(outcome="error")
             logger.error(f"An error occurred in ig_audio callback: {e}", exc_info=True)
             await query.edit_message_text(text=f"🚫 Yuklashda xatolik yuz berdi: {e}")
         return
 
+    # "yt:<token>" — qidiruv natijasi tugmasi; eski tugmalarda callback_data xom video id
+    upload_options = {}
+    if data.startswith("yt:"):
+        payload = callback_store.get(data[3:])
+        if not payload:
+            await _edit_status(query, "⏳ Tugma muddati tugagan. Iltimos, qo'shiq nomini qayta yuboring.")
+            return
+        video_id = payload["video_id"]
+        if payload.get("title"):
+            upload_options["title"] = payload["title"]
+    else:
+        video_id = data
+    audio_key = media_key("yt", video_id, "audio")
+    choices = (query.message.chat.id, query.message.message_id)
     try:
-        # Offload heavy download to a background thread to keep bot responsive
-        new_filename = await asyncio.wait_for(
-            asyncio.to_thread(download_from_youtube, video_id), timeout=90
-        )
+        if await _send_cached(partial(context.bot.send_audio, query.message.chat.id), audio_key):
+            prefetcher.claim(choices, None)
+            await query.delete_message()
+            return
 
-        # If file is too large for Telegram (approx > 49MB), inform user
+        # Oldindan yuklangan (yoki yuklanayotgan) fayl bo'lsa — o'shanga qo'shilamiz
+        prefetched = prefetcher.claim(choices, audio_key)
         try:
-            size_mb = os.path.getsize(new_filename) / (1024 * 1024)
-            if size_mb > 49:
-                await query.edit_message_text(text="🚫 Fayl juda katta (>49MB). Iltimos, qisqaroq trek tanlang yoki boshqa natijani sinab ko'ring.")
-                os.remove(new_filename)
-                return
-        except Exception:
-            pass
+            # Offload heavy download to a background thread to keep bot responsive
+            lease = await downloads.acquire(
+                audio_key, download_from_youtube, video_id, timeout=90,
+                user_id=query.from_user.id, priority=PRIORITY_BUTTON,
+                on_postprocess=_transcode_notice(partial(_edit_status, query)),
+            )
+        finally:
+            if prefetched is not None:
+                prefetched.release()
 
-        with open(new_filename, 'rb') as audio_file:
-            await context.bot.send_audio(chat_id=query.message.chat.id, audio=audio_file)
-        os.remove(new_filename)
+        with lease:
+            # If file is too large for Telegram (approx > 49MB), inform user
+            if _is_too_large(lease.path):
+                await _edit_status(query, TOO_LARGE_TEXT)
+                return
+            await _upload(partial(context.bot.send_audio, query.message.chat.id), lease.path, audio_key,
+                          **upload_options)
         await query.delete_message()
 
+    except asyncio.TimeoutError:
+        OUTCOMES.inc(outcome="timeout")
+        await _edit_status(query, "⏳ Yuklash juda uzoq cho'zildi. Keyinroq urinib ko'ring yoki boshqa natijani sinab ko'ring.")
+    except QueueFull:
+        OUTCOMES.inc(outcome="queue_full")
+        await _edit_status(query, QUEUE_FULL_TEXT)
     except Exception as e:
+        OUTCOMES.inc(outcome="error")
         logger.error(f"An error occurred in button handler: {e}", exc_info=True)
-        await query.edit_message_text(text=f"🚫 Yuklashda xatolik yuz berdi: {e}")
+        await _edit_status(query, f"🚫 Yuklashda xatolik yuz berdi: {e}")
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Global error handler to log exceptions for better observability."""
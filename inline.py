@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+
+from telegram import (Update, InlineQueryResultCachedAudio, InlineQueryResultArticle, InputTextMessageContent)
+from telegram.error import BadRequest
+from telegram.ext import ContextTypes
+
+from youtube import search_youtube, download_from_youtube
+from media_cache import file_id_cache, media_key
+from singleflight import downloads
+from scheduler import scheduler, QueueFull, PRIORITY_SPECULATIVE
+from formats import MAX_UPLOAD_BYTES
+from metrics import Counter, timed, BYTES_UPLOADED
+
+logger = logging.getLogger(__name__)
+
+# Foydalanuvchi yozishni to'xtatgunicha kutiladigan vaqt (har harf uchun alohida so'rov keladi)
+INLINE_DEBOUNCE = float(os.environ.get("INLINE_DEBOUNCE", "0.5"))
+INLINE_MIN_CHARS = int(os.environ.get("INLINE_MIN_CHARS", "3"))
+# Telegram javobni ~10 s kutadi; qidiruv shundan uzoq cho'zilsa, fonda davom etadi
+INLINE_SEARCH_TIMEOUT = float(os.environ.get("INLINE_SEARCH_TIMEOUT", "4"))
+# Hammasi file_id bilan tayyor bo'lgan javoblarni Telegram shuncha soniya keshlaydi
+INLINE_CACHE_TIME = int(os.environ.get("INLINE_CACHE_TIME", "300"))
+# Sovuq natijalar yuklanib, file_id olish uchun shu chatga (masalan, yopiq kanal) yuboriladi
+INLINE_CACHE_CHAT = os.environ.get("INLINE_CACHE_CHAT", "")
+INLINE_WARM_ITEMS = int(os.environ.get("INLINE_WARM_ITEMS", "2"))
+
+INLINE_QUERIES = Counter("bot_inline_queries_total", "Inline queries by result (answered, debounced, timeout, error, empty)")
+INLINE_WARMS = Counter("bot_inline_warm_total", "Background fetches for inline results by result")
+
+# user_id -> eng so'nggi inline so'rov id'si
+_latest: dict[int, str] = {}
+
+
+class InlineWarmer:
+    """Fetches cold inline results in the background so the next identical query is instant.
+
+    Only active with INLINE_CACHE_CHAT set: the file is uploaded there once
+    and its file_id cached, which turns the result into cached audio. Without
+    that chat a download could never become an inline result, so nothing is
+    fetched. Downloads run at PRIORITY_SPECULATIVE and are skipped while real
+    requests are queued.
+    """
+
+    def __init__(self, cache_chat: str = INLINE_CACHE_CHAT, max_items: int = INLINE_WARM_ITEMS):
+        self.cache_chat = cache_chat
+        self.max_items = max_items
+        self._active: set[str] = set()
+
+    def warm(self, bot, entries: list[dict]) -> None:
+        if not self.cache_chat:
+            return
+        for entry in entries[: self.max_items]:
+            key = media_key("yt", entry["id"], "audio")
+            if key in self._active or scheduler.stats()["queued"] > 0:
+                continue
+            self._active.add(key)
+            task = asyncio.create_task(self._fetch(bot, key, entry))
+            task.add_done_callback(lambda _, key=key: self._active.discard(key))
+
+    async def _fetch(self, bot, key: str, entry: dict) -> None:
+        try:
+            lease = await downloads.acquire(key, download_from_youtube, entry["id"], priority=PRIORITY_SPECULATIVE)
+        except QueueFull:
+            INLINE_WARMS.inc(result="skipped")
+            return
+        except Exception as e:
+            logger.info("Inline natija yuklanmadi (%s): %s", key, e)
+            INLINE_WARMS.inc(result="failed")
+            return
+        with lease:
+            if file_id_cache.contains(key):
+                INLINE_WARMS.inc(result="downloaded")
+                return
+            try:
+                size = os.path.getsize(lease.path)
+                if size > MAX_UPLOAD_BYTES:
+                    INLINE_WARMS.inc(result="too_large")
+                    return
+                with open(lease.path, "rb") as audio:
+                    sent = await bot.send_audio(self.cache_chat, audio, title=entry.get("title"),
+                                                disable_notification=True)
+            except Exception as e:
+                logger.warning("Inline kesh chatiga yuborilmadi (%s): %s", key, e)
+                INLINE_WARMS.inc(result="failed")
+                return
+            BYTES_UPLOADED.inc(size)
+            if sent.audio:
+                file_id_cache.put(key, sent.audio.file_id)
+            INLINE_WARMS.inc(result="uploaded")
+
+
+inline_warmer = InlineWarmer()
+
+
+def _results(entries: list[dict]) -> tuple[list, list[dict]]:
+    """Inline results for search entries, plus the entries that have no uploaded file yet."""
+    results, cold = [], []
+    for entry in entries:
+        video_id, title = entry.get("id"), entry.get("title") or entry.get("id")
+        if not video_id:
+            continue
+        # peek: har bir harf uchun kesh hit/miss metrikalarini buzmaymiz
+        file_id = file_id_cache.peek(media_key("yt", video_id, "audio"))
+        if file_id:
+            results.append(InlineQueryResultCachedAudio(id=f"a:{video_id}", audio_file_id=file_id))
+        else:
+            cold.append(entry)
+            results.append(InlineQueryResultArticle(
+                id=f"l:{video_id}", title=title, description="YouTube · hali yuklanmagan",
+                input_message_content=InputTextMessageContent(f"🎵 {title}\nhttps://youtu.be/{video_id}"),
+                thumbnail_url=f"https://i.ytimg.com/vi/{video_id}/default.jpg",
+            ))
+    return results, cold
+
+
+@timed("handler", handler="inline_query")
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Answer '@bot query' from the search cache and already uploaded file_ids."""
+    query = update.inline_query
+    text = query.query.strip()
+    user_id = query.from_user.id
+    if len(text) < INLINE_MIN_CHARS:
+        # "abc" -> "ab" bo'lsa, kutayotgan "abc" eskirgan natija bilan javob bermasin
+        _latest.pop(user_id, None)
+        INLINE_QUERIES.inc(result="empty")
+        await query.answer([], cache_time=INLINE_CACHE_TIME)
+        return
+
+    # Har bir harf yangi so'rov: faqat foydalanuvchining eng so'nggisiga javob beramiz
+    _latest[user_id] = query.id
+    await asyncio.sleep(INLINE_DEBOUNCE)
+    if _latest.get(user_id) != query.id:
+        INLINE_QUERIES.inc(result="debounced")
+        return
+    _latest.pop(user_id, None)
+
+    # shield: muddat tugasa ham qidiruv fonda tugab, keshga tushadi
+    search = asyncio.ensure_future(asyncio.to_thread(search_youtube, text))
+    try:
+        entries = await asyncio.wait_for(asyncio.shield(search), INLINE_SEARCH_TIMEOUT)
+    except asyncio.TimeoutError:
+        INLINE_QUERIES.inc(result="timeout")
+        search.add_done_callback(lambda task: task.cancelled() or task.exception())
+        await query.answer([], cache_time=0, is_personal=True)
+        return
+    except Exception as e:
+        logger.warning("Inline qidiruv xatosi (%s): %s", text, e)
+        INLINE_QUERIES.inc(result="error")
+        await query.answer([], cache_time=0, is_personal=True)
+        return
+
+    results, cold = _results(entries)
+    try:
+        await query.answer(results, cache_time=INLINE_CACHE_TIME if not cold else 10)
+    except BadRequest as e:
+        if "too old" in str(e).lower() or "query id is invalid" in str(e).lower():
+            logger.info("Inline so'rov muddati o'tib ketdi: %s", text)
+            return
+        # Eskirgan file_id butun javobni rad ettiradi — ularni unutib, havolalar bilan qayta javob beramiz
+        logger.warning("Inline javob rad etildi: %s", e)
+        for entry in entries:
+            if entry.get("id"):
+                file_id_cache.forget(media_key("yt", entry["id"], "audio"))
+        results, cold = _results(entries)
+        await query.answer(results, cache_time=10)
+    INLINE_QUERIES.inc(result="answered")
+    inline_warmer.warm(context.bot, cold)
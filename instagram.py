@@ -1,5 +1,25 @@
-import yt_dlp
 import os
+import re
+import unicodedata
+
+from cancellation import CancelHook
+from ydl_pool import YDLPool
+from disk_cache import SCRATCH_DIR
+import chunked
+from formats import select_audio_format, select_video_format, FFMPEG_LOCATION
+from metrics import timer, BYTES_DOWNLOADED
+
+# /p/<code>, /reel/<code>, /reels/<code>, /tv/<code>
+_SHORTCODE_RE = re.compile(r"instagram\.com/(?:[^/?#]+/)?(?:p|reels?|tv)/([A-Za-z0-9_-]+)")
+
+_HASHTAG_RE = re.compile(r"#[^\s#@]+")
+_MENTION_RE = re.compile(r"@[\w.]+")
+_URL_RE = re.compile(r"https?://\S+|www\.\S+")
+# yt-dlp IG sarlavhasi ko'pincha "Video by <user>" — qidiruv uchun foydasiz
+# Mention olib tashlangach osilib qoladigan "by"/"feat." kabi so'zlar
+_DANGLING_RE = re.compile(r"\s+(?:by|feat\.?|ft\.?|x|&)$", re.IGNORECASE)
+_GENERIC_TITLE_RE = re.compile(r"^(?:video|post|reel) by \S+$", re.IGNORECASE)
+MAX_QUERY_CHARS = 100
 
 # Use realistic headers to improve Instagram reliability
 DEFAULT_HEADERS = {
@@ -12,7 +32,61 @@ DEFAULT_HEADERS = {
     'Accept-Language': 'en-US,en;q=0.9',
 }
 
-def _ensure_download_dir(path: str = "downloads") -> str:
+# Uzoq yashaydigan YoutubeDL instansiyalari: audio, video va metadata profillari
+AUDIO_POOL = YDLPool("ig_audio", {
+    # Prefer AAC/M4A, then fallback to best available — within the Telegram size limit
+    'format': select_audio_format,
+    'noplaylist': True,
+    'quiet': True,
+    'no_warnings': True,
+    # ".audio" suffix: the video download of the same post may also be an .mp4
+    'outtmpl': os.path.join(SCRATCH_DIR, '%(id)s.audio.%(ext)s'),
+    'socket_timeout': 30,
+    'retries': 3,
+    'nocheckcertificate': True,
+    'fixup': 'never',
+    'ffmpeg_location': FFMPEG_LOCATION,
+    # DASH/HLS bo'laklari parallel yuklanadi
+    'concurrent_fragment_downloads': chunked.DOWNLOAD_CONNECTIONS,
+    'noprogress': True,
+    'http_headers': DEFAULT_HEADERS,
+}, warm_extractors=("Instagram",))
+
+VIDEO_POOL = YDLPool("ig_video", {
+    # Prefer combined MP4 stream to avoid merging — within the Telegram size limit
+    'format': select_video_format,
+    'noplaylist': True,
+    'quiet': True,
+    'no_warnings': True,
+    'outtmpl': os.path.join(SCRATCH_DIR, '%(id)s.%(ext)s'),
+    'socket_timeout': 30,
+    'retries': 3,
+    'nocheckcertificate': True,
+    'fixup': 'never',
+    'ffmpeg_location': FFMPEG_LOCATION,
+    # DASH/HLS bo'laklari parallel yuklanadi
+    'concurrent_fragment_downloads': chunked.DOWNLOAD_CONNECTIONS,
+    'noprogress': True,
+    'http_headers': DEFAULT_HEADERS,
+}, warm_extractors=("Instagram",))
+
+METADATA_POOL = YDLPool("ig_metadata", {
+    'quiet': True,
+    'no_warnings': True,
+    'skip_download': True,
+    'socket_timeout': 20,
+    'retries': 2,
+    'nocheckcertificate': True,
+    'http_headers': DEFAULT_HEADERS,
+}, warm_extractors=("Instagram",))
+
+def _count_downloaded(path: str, source: str) -> None:
+    try:
+        BYTES_DOWNLOADED.inc(os.path.getsize(path), source=source)
+    except OSError:
+        pass
+
+def _ensure_download_dir(path: str = SCRATCH_DIR) -> str:
     if not os.path.isdir(path):
         try:
             os.makedirs(path, exist_ok=True)
@@ -20,97 +94,90 @@ def _ensure_download_dir(path: str = "downloads") -> str:
             return ""
     return path
 
-def download_from_instagram(url):
+def extract_media_id(url: str) -> str | None:
+    """Return the Instagram shortcode (yt-dlp uses it as the media id), or None."""
+    match = _SHORTCODE_RE.search(url or "")
+    return match.group(1) if match else None
+
+def download_from_instagram(url, cancel_event=None):
     """Download audio from Instagram-compatible URLs without ffmpeg postprocessing.
-    Prefer m4a/opus directly and return the file path.
+    Prefer m4a/opus directly and return the file path. Setting cancel_event
+    aborts the transfer and removes partial files.
     """
-    downloads_dir = _ensure_download_dir("downloads")
-    outtmpl = '%(id)s.%(ext)s'
-    if downloads_dir:
-        outtmpl = os.path.join(downloads_dir, outtmpl)
-
-    ydl_opts = {
-        'format': 'bestaudio[acodec~=^mp4a]/bestaudio[ext=m4a]/bestaudio/best',
-        'noplaylist': True,
-        'quiet': True,
-        'no_warnings': True,
-        'outtmpl': outtmpl,
-        'socket_timeout': 30,
-        'retries': 3,
-        'nocheckcertificate': True,
-        'fixup': 'never',
-        'ffmpeg_location': 'ffmpeg',
-        'noprogress': True,
-        'http_headers': DEFAULT_HEADERS,
-    }
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(url, download=True)
-
-        new_filename = None
-        try:
-            if 'requested_downloads' in info and info['requested_downloads']:
-                new_filename = info['requested_downloads'][0].get('filepath')
-        except Exception:
-            new_filename = None
-
-        if not new_filename:
-            new_filename = ydl.prepare_filename(info)
-        return new_filename
+    hook = CancelHook(cancel_event)
+    hook.check()
+    _ensure_download_dir(SCRATCH_DIR)
+    try:
+        with timer("download", source="instagram_audio"), AUDIO_POOL.checkout(progress_hook=hook) as ydl:
+            new_filename = chunked.download(ydl, url, hook)
+            _count_downloaded(new_filename, "instagram_audio")
+            return new_filename
+    except BaseException:
+        # Bekor qilingan yoki xato bilan tugagan yuklash qoldiqlarini tozalaymiz
+        hook.cleanup()
+        raise
 
-def download_instagram_video(url):
+def download_instagram_video(url, cancel_event=None):
     """Download the main Instagram video quickly in MP4 when possible.
-    Returns the file path.
+    Returns the file path. Setting cancel_event aborts the transfer and
+    removes partial files.
     """
-    downloads_dir = _ensure_download_dir("downloads")
-    outtmpl = '%(id)s.%(ext)s'
-    if downloads_dir:
-        outtmpl = os.path.join(downloads_dir, outtmpl)
-
-    ydl_opts = {
-        # Prefer combined MP4 stream to avoid merging
-        'format': 'best[ext=mp4]/best',
-        'noplaylist': True,
-        'quiet': True,
-        'no_warnings': True,
-        'outtmpl': outtmpl,
-        'socket_timeout': 30,
-        'retries': 3,
-        'nocheckcertificate': True,
-        'fixup': 'never',
-        'ffmpeg_location': 'ffmpeg',
-        'noprogress': True,
-        'http_headers': DEFAULT_HEADERS,
-    }
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(url, download=True)
-
-        new_filename = None
-        try:
-            if 'requested_downloads' in info and info['requested_downloads']:
-                new_filename = info['requested_downloads'][0].get('filepath')
-        except Exception:
-            new_filename = None
-
-        if not new_filename:
-            new_filename = ydl.prepare_filename(info)
-        return new_filename
+    hook = CancelHook(cancel_event)
+    hook.check()
+    _ensure_download_dir(SCRATCH_DIR)
+    try:
+        with timer("download", source="instagram_video"), VIDEO_POOL.checkout(progress_hook=hook) as ydl:
+            new_filename = chunked.download(ydl, url, hook)
+            _count_downloaded(new_filename, "instagram_video")
+            return new_filename
+    except BaseException:
+        # Bekor qilingan yoki xato bilan tugagan yuklash qoldiqlarini tozalaymiz
+        hook.cleanup()
+        raise
 
 def get_instagram_caption(url: str) -> str | None:
-    """Extract a human-readable title/caption from an Instagram URL without downloading."""
-    ydl_opts = {
-        'quiet': True,
-        'no_warnings': True,
-        'skip_download': True,
-        'socket_timeout': 20,
-        'retries': 2,
-        'nocheckcertificate': True,
-        'http_headers': DEFAULT_HEADERS,
-    }
+    """Extract a human-readable title/caption from an Instagram URL without downloading.
+
+    Prefers the reel's music metadata ("artist track") when Instagram has it.
+    """
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with timer("caption"), METADATA_POOL.checkout() as ydl:
             info = ydl.extract_info(url, download=False)
             if not info:
                 return None
-            return info.get('title') or info.get('description') or None
+            if info.get('track'):
+                return " ".join(filter(None, (info.get('artist'), info['track'])))
+            title = info.get('title') or ""
+            if not title or _GENERIC_TITLE_RE.match(title.strip()):
+                return info.get('description') or title or None
+            return title
     except Exception:
-        return None
\ No newline at end of file
+        return None
+
+def canonical_url(url: str) -> str | None:
+    """Canonical post URL: /reel/, /reels/, /tv/ and share params (igsh, utm_*) collapse to /p/<code>/."""
+    shortcode = extract_media_id(url)
+    return f"https://www.instagram.com/p/{shortcode}/" if shortcode else None
+
+def clean_caption(caption: str | None) -> str:
+    """Turn a post caption into a search query: drop hashtags, mentions, links and emojis.
+
+    Keeps the first line that still has text and cuts it to MAX_QUERY_CHARS
+    at a word boundary.
+    """
+    text = unicodedata.normalize("NFKC", caption or "")
+    text = _URL_RE.sub(" ", text)
+    text = _HASHTAG_RE.sub(" ", text)
+    text = _MENTION_RE.sub(" ", text)
+    # Emoji, belgilar, teri rangi modifikatorlari, ZWJ va variation selector'lar
+    text = "".join(
+        " " if unicodedata.category(ch) in ("So", "Sk", "Cs", "Co", "Cf") or 0xFE00 <= ord(ch) <= 0xFE0F else ch
+        for ch in text
+    )
+    for line in text.splitlines():
+        line = _DANGLING_RE.sub("", " ".join(line.split())).strip(" -|•·:;,.")
+        if any(ch.isalnum() for ch in line):
+            if len(line) > MAX_QUERY_CHARS:
+                line = line[:MAX_QUERY_CHARS].rsplit(" ", 1)[0]
+            return line
+    return ""
\ No newline at end of file
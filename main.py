@@ -1,5 +1,5 @@
 from bot import main
-from waitress import serve
 
+# Procfile/PaaS entry point: bot.main() picks polling or webhook from BOT_MODE
 if __name__ == "__main__":
-    serve(main, host="0.0.0.0", port=8080)
\ No newline at end of file
+    main()
@@ -0,0 +1,199 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import Gauge
+
+logger = logging.getLogger(__name__)
+
+# SQLite fayl: yuklangan media uchun Telegram file_id'lari saqlanadi
+DB_PATH = os.environ.get("MEDIA_CACHE_DB", "media_cache.sqlite3")
+
+
+def media_key(source: str, media_id: str, kind: str) -> str:
+    """Build a cache key like 'yt:<video_id>:audio' or 'ig:<shortcode>:video'."""
+    return f"{source}:{media_id}:{kind}"
+
+
+class FileIdCache:
+    """Persistent media id -> Telegram file_id mapping.
+
+    A hit lets handlers resend an already uploaded file by file_id instead of
+    downloading and uploading it again.
+    """
+
+    def __init__(self, path: str = DB_PATH):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS file_ids ("
+                " key TEXT PRIMARY KEY,"
+                " file_id TEXT NOT NULL,"
+                " created REAL NOT NULL,"
+                " hits INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str | None) -> str | None:
+        """Return the cached file_id for key (counts a hit or a miss)."""
+        if not key:
+            return None
+        try:
+            with self._lock:
+                conn = self._connect()
+                row = conn.execute("SELECT file_id FROM file_ids WHERE key = ?", (key,)).fetchone()
+                if row:
+                    conn.execute("UPDATE file_ids SET hits = hits + 1 WHERE key = ?", (key,))
+                    conn.commit()
+        except sqlite3.Error as e:
+            logger.warning("file_id cache o'qilmadi: %s", e)
+            row = None
+        if row:
+            self.hits += 1
+            return row[0]
+        self.misses += 1
+        return None
+
+    def peek(self, key: str | None) -> str | None:
+        """The file_id for key without counting a hit or a miss (e.g. to list inline results)."""
+        if not key:
+            return None
+        try:
+            with self._lock:
+                row = self._connect().execute("SELECT file_id FROM file_ids WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("file_id cache o'qilmadi: %s", e)
+            return None
+        return row[0] if row else None
+
+    def contains(self, key: str | None) -> bool:
+        """True if key has a file_id (does not count as a hit or a miss)."""
+        return self.peek(key) is not None
+
+    def put(self, key: str | None, file_id: str | None) -> None:
+        """Remember the file_id Telegram returned for an upload."""
+        if not key or not file_id:
+            return
+        try:
+            with self._lock:
+                conn = self._connect()
+                conn.execute(
+                    "INSERT OR REPLACE INTO file_ids (key, file_id, created, hits) VALUES (?, ?, ?, 0)",
+                    (key, file_id, time.time()),
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.warning("file_id cache yozilmadi: %s", e)
+
+    def forget(self, key: str | None) -> None:
+        """Drop a stale entry (e.g. Telegram rejected the file_id)."""
+        if not key:
+            return
+        try:
+            with self._lock:
+                conn = self._connect()
+                conn.execute("DELETE FROM file_ids WHERE key = ?", (key,))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.warning("file_id cache'dan o'chirilmadi: %s", e)
+
+    def stats(self) -> dict:
+        """Hit/miss counters since process start."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits / total) if total else 0.0,
+        }
+
+
+class InstagramIndex:
+    """Persistent canonical Instagram URL -> caption / search query / resolved YouTube id.
+
+    Lets a reel that was shared before skip the caption fetch and the YouTube
+    search on the caption-to-YouTube path.
+    """
+
+    def __init__(self, path: str = DB_PATH):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS instagram_posts ("
+                " url TEXT PRIMARY KEY,"
+                " shortcode TEXT,"
+                " caption TEXT,"
+                " query TEXT,"
+                " youtube_id TEXT,"
+                " updated REAL NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, url: str | None) -> dict | None:
+        """Known facts about a canonical post URL, or None."""
+        if not url:
+            return None
+        try:
+            with self._lock:
+                row = self._connect().execute(
+                    "SELECT shortcode, caption, query, youtube_id FROM instagram_posts WHERE url = ?", (url,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Instagram index o'qilmadi: %s", e)
+            row = None
+        if not row:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {"shortcode": row[0], "caption": row[1], "query": row[2], "youtube_id": row[3]}
+
+    def put(self, url: str | None, shortcode: str | None = None, caption: str | None = None,
+            query: str | None = None, youtube_id: str | None = None) -> None:
+        """Record what was resolved for url; None fields keep their stored value."""
+        if not url:
+            return
+        try:
+            with self._lock:
+                conn = self._connect()
+                conn.execute(
+                    "INSERT INTO instagram_posts (url, shortcode, caption, query, youtube_id, updated)"
+                    " VALUES (?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT(url) DO UPDATE SET"
+                    "  shortcode = COALESCE(excluded.shortcode, shortcode),"
+                    "  caption = COALESCE(excluded.caption, caption),"
+                    "  query = COALESCE(excluded.query, query),"
+                    "  youtube_id = COALESCE(excluded.youtube_id, youtube_id),"
+                    "  updated = excluded.updated",
+                    (url, shortcode, caption, query, youtube_id, time.time()),
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.warning("Instagram index yozilmadi: %s", e)
+
+
+file_id_cache = FileIdCache()
+ig_index = InstagramIndex()
+Gauge("bot_file_id_cache_hits", "Telegram file_id cache hits since start", lambda: file_id_cache.hits)
+Gauge("bot_file_id_cache_misses", "Telegram file_id cache misses since start", lambda: file_id_cache.misses)
+Gauge("bot_instagram_index_hits", "Instagram URL index hits since start", lambda: ig_index.hits)
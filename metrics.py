@@ -0,0 +1,148 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# Timeoutlarni (8/12/20/40/90 s) sozlash uchun mos bucketlar
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 12, 20, 30, 40, 60, 90, 120)
+
+_REGISTRY: list = []
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    body = ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + body + "}"
+
+
+class Counter:
+    """Monotonic counter with optional labels (thread-safe)."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name + _format_labels(key), value
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels (thread-safe)."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [bucket counts..., sum, count]
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(row)) for key, row in self._values.items()]
+        for key, row in items:
+            for bound, count in zip(self.buckets, row):
+                yield self.name + "_bucket" + _format_labels(key, (("le", repr(float(bound))),)), count
+            yield self.name + "_bucket" + _format_labels(key, (("le", "+Inf"),)), row[-1]
+            yield self.name + "_sum" + _format_labels(key), row[-2]
+            yield self.name + "_count" + _format_labels(key), row[-1]
+
+
+class Gauge:
+    """Gauge read from a callback at scrape time (e.g. queue depth, cache size)."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, read):
+        self.name = name
+        self.help = help_text
+        self._read = read
+        _REGISTRY.append(self)
+
+    def samples(self):
+        try:
+            value = self._read()
+        except Exception:
+            return
+        yield self.name, value
+
+
+def render() -> str:
+    """All registered metrics in Prometheus text exposition format."""
+    lines = []
+    for metric in _REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, value in metric.samples():
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# Bosqichlar: search, caption, download, size_check, upload, cleanup, handler
+STAGE_SECONDS = Histogram("bot_stage_seconds", "Latency of request stages in seconds")
+OUTCOMES = Counter("bot_outcomes_total", "Request outcomes (ok, timeout, too_large, queue_full, error, cache_hit)")
+IG_RACE_WINNER = Counter("bot_ig_race_winner_total", "Which Instagram race branch finished first")
+BYTES_DOWNLOADED = Counter("bot_downloaded_bytes_total", "Bytes downloaded from media sources")
+BYTES_UPLOADED = Counter("bot_uploaded_bytes_total", "Bytes uploaded to Telegram")
+QUEUE_WAIT_SECONDS = Histogram("bot_download_queue_wait_seconds", "Time downloads wait in the scheduler queue")
+
+
+def timer(stage: str, **labels):
+    """Context manager timing one stage into bot_stage_seconds."""
+    return STAGE_SECONDS.time(stage=stage, **labels)
+
+
+def timed(stage: str, **labels):
+    """Decorator timing an async function (e.g. a whole handler) as one stage."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with timer(stage, **labels):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import os
+
+from youtube import download_from_youtube
+from media_cache import file_id_cache, media_key
+from singleflight import downloads
+from scheduler import scheduler, QueueFull, PRIORITY_SPECULATIVE
+from disk_cache import disk_cache
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# Fallback tugmalaridan nechtasi oldindan yuklanadi (0 — o'chirilgan)
+PREFETCH_CANDIDATES = int(os.environ.get("PREFETCH_CANDIDATES", "2"))
+# Bir vaqtda ishlaydigan oldindan yuklashlar va ular egallashi mumkin bo'lgan disk hajmi
+PREFETCH_MAX_ACTIVE = int(os.environ.get("PREFETCH_MAX_ACTIVE", "4"))
+PREFETCH_MAX_MB = int(os.environ.get("PREFETCH_MAX_MB", "200"))
+# Tugma bosilmasa, shuncha soniyadan keyin bekor qilinadi / keshdan o'chiriladi
+PREFETCH_TTL = float(os.environ.get("PREFETCH_TTL", "180"))
+
+PREFETCHES = Counter("bot_prefetch_total", "Speculative downloads by result (started, used, unused, skipped)")
+
+
+class _Prefetch:
+    """One speculative download; holds its lease so the file stays available."""
+
+    __slots__ = ("key", "task", "lease", "size", "claimed")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.task: asyncio.Task | None = None
+        self.lease = None
+        self.size = 0
+        # Tugma bosilgan yoki bekor qilingan: hajmi endi prefetch byudjetiga kirmaydi
+        self.claimed = False
+
+    def release(self) -> None:
+        """Give up this prefetch: release the finished file or cancel the download."""
+        if self.lease is not None:
+            self.lease.release()
+        elif self.task is not None:
+            self.task.cancel()
+
+
+class Prefetcher:
+    """Downloads the candidates of a button list before the user picks one.
+
+    Prefetches run at PRIORITY_SPECULATIVE, so they only use scheduler
+    workers that real requests leave idle, and are skipped entirely when
+    requests are already queued or the active/size budget is used up. A tap
+    joins the in-flight (or finished) download through the single-flight
+    group, which moves a still-queued prefetch up to the tap's priority and
+    user; the other candidates of that list are cancelled. Unclaimed
+    prefetches are cancelled, and their files evicted, after PREFETCH_TTL.
+    """
+
+    def __init__(self, candidates: int = PREFETCH_CANDIDATES, max_active: int = PREFETCH_MAX_ACTIVE,
+                 max_bytes: int = PREFETCH_MAX_MB * 1024 * 1024, ttl: float = PREFETCH_TTL):
+        self.candidates = candidates
+        self.max_active = max_active
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._groups: dict[tuple, list[_Prefetch]] = {}
+        self._active = 0
+        self._held_bytes = 0
+
+    def start(self, group_id: tuple, video_ids: list[str]) -> None:
+        """Begin prefetching the first candidates of a button list identified by group_id."""
+        if self.candidates <= 0 or group_id in self._groups:
+            return
+        entries = []
+        for video_id in video_ids[: self.candidates]:
+            key = media_key("yt", video_id, "audio")
+            # file_id bo'lsa tugma darhol javob beradi — yuklash shart emas
+            if file_id_cache.contains(key):
+                continue
+            if (self._active >= self.max_active or self._held_bytes >= self.max_bytes
+                    or scheduler.stats()["queued"] > 0):
+                PREFETCHES.inc(result="skipped")
+                continue
+            entry = _Prefetch(key)
+            entry.task = asyncio.create_task(self._fetch(entry, video_id))
+            entries.append(entry)
+            PREFETCHES.inc(result="started")
+        if entries:
+            self._groups[group_id] = entries
+            asyncio.get_running_loop().call_later(self.ttl, self._expire, group_id)
+
+    async def _fetch(self, entry: _Prefetch, video_id: str) -> None:
+        self._active += 1
+        try:
+            lease = await downloads.acquire(entry.key, download_from_youtube, video_id,
+                                            priority=PRIORITY_SPECULATIVE)
+        except (asyncio.CancelledError, QueueFull):
+            return
+        except Exception as e:
+            logger.info("Prefetch bajarilmadi (%s): %s", entry.key, e)
+            return
+        finally:
+            self._active -= 1
+        try:
+            entry.size = os.path.getsize(lease.path)
+        except OSError:
+            entry.size = 0
+        entry.lease = lease
+        # Yuklash davomida tugma bosilgan bo'lsa, fayl endi foydalanuvchiniki
+        if not entry.claimed:
+            self._held_bytes += entry.size
+
+    def claim(self, group_id: tuple, key: str | None) -> _Prefetch | None:
+        """A button of group_id was pressed: cancel the other candidates.
+
+        Returns the prefetch for key (if any); the caller must release() it
+        after joining the download itself, so the file is not dropped between.
+        """
+        kept = None
+        for entry in self._groups.pop(group_id, ()):
+            if entry.key == key:
+                kept = entry
+                PREFETCHES.inc(result="used")
+                self._unhold(entry)
+            else:
+                self._drop(entry)
+        return kept
+
+    def _expire(self, group_id: tuple) -> None:
+        for entry in self._groups.pop(group_id, ()):
+            self._drop(entry)
+
+    def _unhold(self, entry: _Prefetch) -> None:
+        """Take entry out of the byte budget; a download still running will not add it later."""
+        if entry.lease is not None and not entry.claimed:
+            self._held_bytes -= entry.size
+        entry.claimed = True
+
+    def _drop(self, entry: _Prefetch) -> None:
+        PREFETCHES.inc(result="unused")
+        self._unhold(entry)
+        finished = entry.lease is not None
+        entry.release()
+        if finished:
+            # Hech kim so'ramagan fayl keshda joy egallamasin
+            disk_cache.discard(entry.key)
+
+    def cancel_all(self) -> None:
+        for group_id in list(self._groups):
+            self._expire(group_id)
+
+
+prefetcher = Prefetcher()
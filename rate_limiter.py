@@ -0,0 +1,254 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from datetime import timedelta
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import Counter
+from ttl_cache import TTLCache, MISSING
+from workers import BOT_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Telegram cheklovlari: ~30 xabar/s umumiy, ~1 xabar/s bitta chatga, guruhga 20 xabar/daqiqa.
+# Umumiy cheklov butun bot uchun — worker jarayonlari orasida teng bo'linadi
+TG_GLOBAL_RATE = float(os.environ.get("TG_GLOBAL_RATE", "30")) / max(1, BOT_WORKERS)
+TG_CHAT_RATE = float(os.environ.get("TG_CHAT_RATE", "1"))
+TG_GROUP_RATE_PER_MIN = float(os.environ.get("TG_GROUP_RATE_PER_MIN", "20"))
+TG_CHAT_BURST = float(os.environ.get("TG_CHAT_BURST", "3"))
+TG_MAX_RETRIES = int(os.environ.get("TG_MAX_RETRIES", "3"))
+
+PRIORITY_MEDIA = 0
+PRIORITY_STATUS = 1
+
+# Foydalanuvchi kutayotgan fayllar status xabarlaridan oldin yuboriladi
+MEDIA_ENDPOINTS = {
+    "sendAudio", "sendVideo", "sendDocument", "sendVoice", "sendMediaGroup", "sendAnimation", "sendPhoto",
+}
+# Bir xabarning navbatda turgan eski tahriri yangisi bilan almashtiriladi
+COALESCED_ENDPOINTS = {"editMessageText", "editMessageCaption"}
+
+RETRY_AFTER = Counter("bot_telegram_retry_after_total", "RetryAfter (flood wait) responses from Telegram")
+COALESCED_EDITS = Counter("bot_coalesced_edits_total", "Status edits skipped because a newer edit superseded them")
+
+
+def _seconds(retry_after) -> float:
+    return retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+
+
+class _Bucket:
+    """Token bucket: ``rate`` tokens per second, at most ``burst`` saved up."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.blocked_until > now:
+            return self.blocked_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class _Gate:
+    """A bucket whose tokens go to waiting calls in priority order (FIFO within a priority)."""
+
+    __slots__ = ("bucket", "waiters", "turn")
+
+    _seq = itertools.count()
+
+    def __init__(self, bucket: _Bucket):
+        self.bucket = bucket
+        self.waiters: list = []
+        self.turn = asyncio.Condition()
+
+    async def acquire(self, priority: int, stale=None) -> bool:
+        """Take a token; returns False without taking one once ``stale()`` becomes true."""
+        entry = (priority, next(self._seq))
+        heapq.heappush(self.waiters, entry)
+        is_stale = stale or (lambda: False)
+        try:
+            async with self.turn:
+                while True:
+                    await self.turn.wait_for(lambda: self.waiters[0] == entry or is_stale())
+                    if is_stale():
+                        return False
+                    delay = self.bucket.delay(time.monotonic())
+                    if not delay:
+                        self.bucket.take()
+                        return True
+                    # Navbat boshidagi kutadi; yuqoriroq ustuvorlikdagi so'rov kelsa, u oldinga o'tadi
+                    try:
+                        await asyncio.wait_for(self.turn.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            self.waiters.remove(entry)
+            heapq.heapify(self.waiters)
+            await self.wake()
+
+    async def wake(self) -> None:
+        """Make every waiter re-check its turn (and whether it went stale)."""
+        async with self.turn:
+            self.turn.notify_all()
+
+
+class _EditState:
+    """Pending edits of one message; only the newest generation is actually sent.
+
+    All generations queued together share one future, resolved by whichever
+    generation is newest when its call finishes, so superseded waiters never
+    wait on a future that nobody will resolve.
+    """
+
+    __slots__ = ("key", "generation", "latest", "waiters")
+
+    def __init__(self, key: tuple):
+        self.key = key
+        self.generation = 0
+        self.latest: asyncio.Future | None = None
+        self.waiters = 0
+
+    def join(self) -> int:
+        self.generation += 1
+        self.waiters += 1
+        if self.latest is None or self.latest.done():
+            self.latest = asyncio.get_running_loop().create_future()
+        return self.generation
+
+    def resolve(self, generation: int, result=None, error: Exception | None = None) -> None:
+        if generation != self.generation or self.latest.done():
+            return
+        if error is None:
+            self.latest.set_result(result)
+        else:
+            self.latest.set_exception(error)
+            self.latest.exception()  # eski tahrirlar bo'lmasa ham "never retrieved" ogohlantirishi chiqmasin
+
+    def leave(self, generation: int) -> bool:
+        """Drop one waiter; True when nobody is left and the state can be forgotten."""
+        if generation == self.generation and not self.latest.done():
+            self.latest.cancel()
+        self.waiters -= 1
+        return self.waiters == 0
+
+
+class TelegramRateLimiter(BaseRateLimiter):
+    """Throttles every Bot API call that targets a chat, retrying on RetryAfter.
+
+    Each call first waits for its chat's bucket (private or group limit), then
+    for the global bucket. Both hand out tokens in priority order, so media
+    uploads overtake queued status messages. A text/caption edit that is still
+    waiting when a newer edit of the same message arrives leaves the queues
+    without using a token and returns the newer edit's result instead. getUpdates and calls without a
+    chat (answerCallbackQuery, getMe, ...) are never delayed.
+    """
+
+    def __init__(self, global_rate: float = TG_GLOBAL_RATE, chat_rate: float = TG_CHAT_RATE,
+                 group_rate_per_min: float = TG_GROUP_RATE_PER_MIN, max_retries: int = TG_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate_per_min / 60
+        self.max_retries = max_retries
+        self._global = _Gate(_Bucket(global_rate, global_rate))
+        self._chats = TTLCache(max_size=50_000, ttl=600)
+        # (endpoint, chat_id, message_id) -> pending edits of that message
+        self._edits: dict[tuple, _EditState] = {}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        self._edits.clear()
+
+    def _chat_gate(self, chat_id) -> _Gate:
+        gate = self._chats.get(chat_id)
+        if gate is MISSING:
+            # Manfiy id — guruh/kanal
+            is_group = isinstance(chat_id, str) or int(chat_id) < 0
+            gate = _Gate(_Bucket(self.group_rate if is_group else self.chat_rate, TG_CHAT_BURST))
+        self._chats.set(chat_id, gate)
+        return gate
+
+    async def _acquire(self, gate: _Gate, priority: int, stale=None) -> bool:
+        """Chat token, then global token; False if the call went stale while waiting."""
+        return await gate.acquire(priority, stale) and await self._global.acquire(priority, stale)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            return await self._call(callback, args, kwargs, endpoint, None, PRIORITY_STATUS)
+
+        edit = None
+        if endpoint in COALESCED_ENDPOINTS and data.get("message_id") is not None:
+            key = (endpoint, chat_id, data["message_id"])
+            edit = self._edits.get(key)
+            if edit is None:
+                edit = self._edits[key] = _EditState(key)
+            generation = edit.join()
+        priority = PRIORITY_MEDIA if endpoint in MEDIA_ENDPOINTS else PRIORITY_STATUS
+        gate = self._chat_gate(chat_id)
+        try:
+            stale = None
+            if edit is not None:
+                stale = lambda: edit.generation != generation  # noqa: E731
+                if generation > 1:
+                    # Navbatdagi eski tahrirlar token olmasdan chiqib ketsin
+                    await gate.wake()
+                    await self._global.wake()
+            if not await self._acquire(gate, priority, stale):
+                newest = edit.latest
+                try:
+                    result = await asyncio.shield(newest)
+                    COALESCED_EDITS.inc()
+                    return result
+                except (Exception, asyncio.CancelledError):
+                    if not newest.done():
+                        raise
+                # Yangi tahrir muvaffaqiyatsiz bo'ldi — o'zimiznikini yuboramiz
+                await self._acquire(gate, priority)
+            result = await self._call(callback, args, kwargs, endpoint, gate, priority)
+            if edit is not None:
+                edit.resolve(generation, result)
+            return result
+        except Exception as e:
+            if edit is not None:
+                edit.resolve(generation, error=e)
+            raise
+        finally:
+            if edit is not None and edit.leave(generation):
+                self._edits.pop(edit.key, None)
+
+    async def _call(self, callback, args, kwargs, endpoint: str, gate: _Gate | None, priority: int):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                delay = _seconds(e.retry_after)
+                RETRY_AFTER.inc(endpoint=endpoint)
+                if attempt >= self.max_retries:
+                    raise
+                logger.warning("Telegram flood limit (%s): %.0f s kutamiz", endpoint, delay)
+                # Chatga tegishli so'rov bo'lsa — faqat o'sha chat to'xtaydi
+                (gate.bucket if gate is not None else self._global.bucket).block(delay)
+                if gate is not None:
+                    await gate.acquire(priority)
+                else:
+                    await asyncio.sleep(delay)
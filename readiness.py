@@ -0,0 +1,47 @@
+import logging
+import threading
+import time
+
+from metrics import Gauge
+
+logger = logging.getLogger(__name__)
+
+# Taxminan jarayon boshlangan vaqt: bu modul bot.py bilan birga eng avval yuklanadi
+_STARTED = time.monotonic()
+
+
+class Readiness:
+    """Startup steps that must finish before the bot reports itself ready (/ready).
+
+    The bot already answers updates while steps are pending (e.g. /ping and
+    /start right after launch); readiness only tells health checks and load
+    balancers that the first download will not pay the warm-up cost.
+    """
+
+    def __init__(self, *steps: str):
+        self._pending = set(steps)
+        self._lock = threading.Lock()
+        self.ready_after: float | None = None
+
+    def mark(self, step: str) -> None:
+        """Record that step finished; safe to call from any thread."""
+        with self._lock:
+            self._pending.discard(step)
+            if self._pending or self.ready_after is not None:
+                return
+            self.ready_after = time.monotonic() - _STARTED
+        logger.info("Bot tayyor: ishga tushganidan %.2f s o'tib", self.ready_after)
+
+    @property
+    def is_ready(self) -> bool:
+        return self.ready_after is not None
+
+    def pending(self) -> list[str]:
+        with self._lock:
+            return sorted(self._pending)
+
+
+# warm_up — yt_dlp importi va YoutubeDL pool'lari; telegram — Application.initialize (getMe)
+readiness = Readiness("warm_up", "telegram")
+
+Gauge("bot_ready", "1 once background warm-up and Telegram startup have finished", lambda: int(readiness.is_ready))
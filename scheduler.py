@@ -0,0 +1,197 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from metrics import Gauge, QUEUE_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", "8"))
+PER_USER_DOWNLOADS = int(os.environ.get("PER_USER_DOWNLOADS", "3"))
+MAX_QUEUE_DEPTH = int(os.environ.get("MAX_QUEUE_DEPTH", "50"))
+
+# Kichik raqam — yuqori ustuvorlik
+PRIORITY_BUTTON = 0
+PRIORITY_NORMAL = 1
+PRIORITY_SPECULATIVE = 2
+
+
+class QueueFull(Exception):
+    """Raised by DownloadScheduler.submit when the wait queue is at capacity."""
+
+    def __init__(self, depth: int):
+        super().__init__(f"download queue is full ({depth} waiting)")
+        self.depth = depth
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "func", "args", "user_id", "future", "enqueued_at",
+                 "cancel_event", "discard")
+
+    def __init__(self, priority, seq, func, args, user_id, future, cancel_event=None, discard=None):
+        self.priority = priority
+        self.seq = seq
+        self.func = func
+        self.args = args
+        self.user_id = user_id
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.cancel_event = cancel_event
+        self.discard = discard
+
+    def __lt__(self, other: "_Job") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class DownloadScheduler:
+    """Bounded worker pool for blocking downloads.
+
+    Jobs are started in priority order (then FIFO), at most ``workers`` at a
+    time and at most ``per_user`` per user; other users' jobs overtake a user
+    who is at the cap. When ``max_queue`` jobs are already waiting, submit()
+    raises QueueFull instead of queueing.
+    """
+
+    def __init__(self, workers: int = DOWNLOAD_WORKERS, per_user: int = PER_USER_DOWNLOADS,
+                 max_queue: int = MAX_QUEUE_DEPTH):
+        self.workers = workers
+        self.per_user = per_user
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="download")
+        self._queue: list[_Job] = []
+        self._seq = itertools.count()
+        self._running = 0
+        self._running_per_user: Counter = Counter()
+        # Navbatda kutish vaqtlari (soniya) — metrikalar uchun
+        self.wait_times: deque = deque(maxlen=1000)
+        self.completed = 0
+        self.rejected = 0
+
+    def position(self, job: _Job) -> int:
+        """1-based position of a waiting job in start order."""
+        return sum(1 for other in self._queue if other < job) + 1
+
+    async def submit(self, func, *args, user_id=None, priority: int = PRIORITY_NORMAL, on_queued=None,
+                     cancellable: bool = False, discard=None, on_submitted=None):
+        """Run func(*args) on the download pool and return its result.
+
+        ``on_queued`` (async, optional) is awaited with the queue position when
+        the job cannot start immediately. With ``cancellable`` the job is called
+        with a ``cancel_event`` keyword that is set if the caller is cancelled
+        while it runs. ``discard`` receives a result nobody is waiting for any
+        more (e.g. to delete a file that finished just after cancellation).
+        ``on_submitted`` receives the job handle, which promote() accepts.
+        """
+        if len(self._queue) >= self.max_queue:
+            self.rejected += 1
+            raise QueueFull(len(self._queue))
+        loop = asyncio.get_running_loop()
+        job = _Job(priority, next(self._seq), func, args, user_id, loop.create_future(),
+                   cancel_event=threading.Event() if cancellable else None, discard=discard)
+        heapq.heappush(self._queue, job)
+        if on_submitted is not None:
+            on_submitted(job)
+        self._dispatch()
+        try:
+            if on_queued is not None and job in self._queue:
+                try:
+                    await on_queued(self.position(job))
+                except Exception as e:
+                    logger.warning("Navbat xabari yuborilmadi: %s", e)
+            return await job.future
+        except asyncio.CancelledError:
+            if job in self._queue:
+                # Hali boshlanmagan — navbatdan olib tashlaymiz
+                self._queue.remove(job)
+                heapq.heapify(self._queue)
+            elif job.cancel_event is not None:
+                # Ishlayapti — yt-dlp progress hook orqali to'xtatamiz
+                job.cancel_event.set()
+            raise
+
+    def promote(self, job: _Job, priority: int, user_id=None) -> bool:
+        """Raise a waiting job's priority and charge it to user_id if it had no user.
+
+        Used when a real request joins a speculative download. Returns False
+        (and changes nothing) if the job has already started.
+        """
+        if job not in self._queue:
+            return False
+        job.priority = min(job.priority, priority)
+        if job.user_id is None:
+            job.user_id = user_id
+        heapq.heapify(self._queue)
+        self._dispatch()
+        return True
+
+    def _dispatch(self) -> None:
+        """Start as many waiting jobs as the worker and per-user limits allow."""
+        if self._running >= self.workers or not self._queue:
+            return
+        skipped = []
+        while self._queue and self._running < self.workers:
+            job = heapq.heappop(self._queue)
+            if job.future.done():
+                continue
+            if job.user_id is not None and self._running_per_user[job.user_id] >= self.per_user:
+                skipped.append(job)
+                continue
+            self._start(job)
+        for job in skipped:
+            heapq.heappush(self._queue, job)
+
+    def _start(self, job: _Job) -> None:
+        loop = asyncio.get_running_loop()
+        waited = time.monotonic() - job.enqueued_at
+        self.wait_times.append(waited)
+        QUEUE_WAIT_SECONDS.observe(waited, priority=job.priority)
+        self._running += 1
+        if job.user_id is not None:
+            self._running_per_user[job.user_id] += 1
+        func = job.func
+        if job.cancel_event is not None:
+            func = partial(func, cancel_event=job.cancel_event)
+        work = loop.run_in_executor(self._executor, func, *job.args)
+        work.add_done_callback(lambda fut, job=job: self._finish(job, fut))
+
+    def _finish(self, job: _Job, work: asyncio.Future) -> None:
+        self._running -= 1
+        self.completed += 1
+        if job.user_id is not None:
+            self._running_per_user[job.user_id] -= 1
+            if self._running_per_user[job.user_id] <= 0:
+                del self._running_per_user[job.user_id]
+        error = work.exception()
+        if not job.future.done():
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(work.result())
+        elif error is None and job.discard is not None:
+            job.discard(work.result())
+        self._dispatch()
+
+    def stats(self) -> dict:
+        waits = sorted(self.wait_times)
+        return {
+            "running": self._running,
+            "queued": len(self._queue),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "wait_p50": waits[len(waits) // 2] if waits else 0.0,
+            "wait_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+            "wait_max": waits[-1] if waits else 0.0,
+        }
+
+
+scheduler = DownloadScheduler()
+Gauge("bot_downloads_running", "Downloads currently running", lambda: scheduler._running)
+Gauge("bot_download_queue_depth", "Downloads waiting in the queue", lambda: len(scheduler._queue))
+Gauge("bot_download_queue_rejected", "Downloads rejected because the queue was full", lambda: scheduler.rejected)
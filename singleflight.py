@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import os
+from functools import partial
+
+from scheduler import scheduler, PRIORITY_NORMAL
+from disk_cache import disk_cache
+from transcode import transcoder
+from metrics import timer
+
+logger = logging.getLogger(__name__)
+
+
+def _remove_file(path) -> None:
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning("Faylni o'chirib bo'lmadi %s: %s", path, e)
+
+
+class _Flight:
+    __slots__ = ("task", "refs", "job", "downloaded", "postprocessing", "listeners", "lingering")
+
+    def __init__(self):
+        self.task: asyncio.Future | None = None
+        self.refs = 0
+        # Runner'dagi ish (navbatda turgan bo'lsa, keyin qo'shilgan so'rov uni oldinga suradi)
+        self.job = None
+        # Yuklash tugadi: endi faqat postprocess (masalan, qayta kodlash) qolgan
+        self.downloaded = asyncio.Event()
+        self.postprocessing = False
+        self.listeners: list = []
+        self.lingering = False
+
+    def add_listener(self, on_postprocess) -> None:
+        if self.postprocessing:
+            _notify(on_postprocess)
+        else:
+            self.listeners.append(on_postprocess)
+
+    def postprocess_started(self) -> None:
+        self.postprocessing = True
+        for on_postprocess in self.listeners:
+            _notify(on_postprocess)
+        self.listeners.clear()
+
+
+def _notify(on_postprocess) -> None:
+    task = asyncio.ensure_future(on_postprocess())
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+class Lease:
+    """A handler's share of a coalesced download. Release it once the file is sent."""
+
+    def __init__(self, group: "SingleFlight", key: str, flight: _Flight, path: str):
+        self._group = group
+        self._key = key
+        self._flight = flight
+        self.path = path
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._group._release(self._key, self._flight)
+
+    def __enter__(self) -> "Lease":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+class SingleFlight:
+    """Coalesce concurrent downloads of the same media id into one.
+
+    The first caller for a key starts ``func(*args)`` through ``runner`` (the
+    download scheduler); later callers for the same key await that same
+    result. If every caller gives up (timeout or cancellation) before the
+    download finishes, the download itself is cancelled.
+
+    An optional ``postprocess(key, path, started)`` coroutine runs on the
+    finished file before it is shared (e.g. re-encoding audio that is over
+    the upload limit) and returns the path to use instead; it calls
+    ``started()`` when it begins slow work, which fires the callers'
+    ``on_postprocess`` callbacks. A caller's timeout covers the download
+    only: once it is done, callers wait for postprocessing (bounded by the
+    postprocessor itself), and postprocessing that has begun runs to the
+    end and is cached even if every caller has gone.
+
+    With an enabled ``cache`` a finished file is moved into the disk cache,
+    served from there on later requests and pinned while leases are held;
+    otherwise it is removed via ``cleanup`` once every lease is released.
+    """
+
+    def __init__(self, runner=scheduler.submit, cleanup=_remove_file, cache=disk_cache, postprocess=None,
+                 promote=scheduler.promote):
+        self._runner = runner
+        self._promote = promote
+        self._cleanup = cleanup
+        self._postprocess = postprocess
+        self._cache = cache if cache is not None and cache.enabled else None
+        self._flights: dict[str, _Flight] = {}
+
+    async def acquire(self, key: str, func, *args, timeout: float | None = None, on_postprocess=None,
+                      **submit_opts) -> Lease:
+        """Join (or start) the download for key and wait up to timeout seconds for it.
+
+        ``submit_opts`` (user_id, priority, on_queued) are passed to the runner
+        by the caller that starts the download; a later caller whose download
+        is still queued promotes it to its own priority and user (e.g. a tap
+        joining a speculative prefetch). ``on_postprocess`` (async, no
+        arguments) is awaited in the background if slow postprocessing starts.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            flight.task = self._start(key, flight, func, args, submit_opts)
+            self._flights[key] = flight
+            if self._cache:
+                self._cache.pin(key)
+        else:
+            logger.info("Download coalesced: %s", key)
+            if flight.job is not None and self._promote is not None:
+                self._promote(flight.job, submit_opts.get("priority", PRIORITY_NORMAL), submit_opts.get("user_id"))
+        flight.refs += 1
+        if on_postprocess is not None:
+            flight.add_listener(on_postprocess)
+        try:
+            path = await self._wait(flight, timeout)
+        except BaseException:
+            self._release(key, flight)
+            raise
+        return Lease(self, key, flight, path)
+
+    @staticmethod
+    async def _wait(flight: _Flight, timeout: float | None) -> str:
+        # shield/wait: one caller timing out must not cancel the shared download
+        if timeout is not None and not flight.task.done():
+            downloaded = asyncio.ensure_future(flight.downloaded.wait())
+            try:
+                await asyncio.wait((flight.task, downloaded), timeout=timeout,
+                                   return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                downloaded.cancel()
+            if not flight.task.done() and not flight.downloaded.is_set():
+                raise asyncio.TimeoutError()
+        # Yuklash tugagan: qayta kodlash o'z muddati (TRANSCODE_TIMEOUT) bilan cheklangan
+        return await asyncio.shield(flight.task)
+
+    def _start(self, key: str, flight: _Flight, func, args, submit_opts) -> asyncio.Future:
+        cached = self._cache.get(key) if self._cache else None
+        if cached:
+            logger.info("Disk cache hit: %s", key)
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(cached)
+            return future
+        return asyncio.ensure_future(self._fetch(key, flight, func, args, submit_opts))
+
+    async def _fetch(self, key: str, flight: _Flight, func, args, submit_opts) -> str:
+        path = await self._runner(
+            func, *args, cancellable=True, discard=partial(self._keep_late, key),
+            on_submitted=partial(setattr, flight, "job"), **submit_opts
+        )
+        if self._postprocess and path:
+            flight.downloaded.set()
+            try:
+                path = await self._postprocess(key, path, flight.postprocess_started)
+            except BaseException:
+                # Hali keshga tushmagan — o'zimiz o'chiramiz
+                self._cleanup(path)
+                raise
+        return self._keep(key, path)
+
+    def _keep_late(self, key: str, path: str) -> None:
+        """A download finished after everyone gave up: postprocess it like any other before caching."""
+        if not self._postprocess or not path:
+            self._keep(key, path)
+            return
+        task = asyncio.ensure_future(self._postprocess(key, path, lambda: None))
+
+        def done(task: asyncio.Future) -> None:
+            if task.cancelled() or task.exception() is not None:
+                # Qayta kodlanmagan (Telegram rad etadigan) fayl keshga tushmasin
+                self._cleanup(path)
+                return
+            self._keep(key, task.result())
+
+        task.add_done_callback(done)
+
+    def _keep(self, key: str, path: str) -> str:
+        """Move a finished download into the cache; without a cache, late results are removed."""
+        if self._cache:
+            return self._cache.put(key, path)
+        if key not in self._flights:
+            self._cleanup(path)
+        return path
+
+    def _release(self, key: str, flight: _Flight) -> None:
+        flight.refs -= 1
+        if flight.refs > 0 or flight.lingering:
+            return
+        if flight.downloaded.is_set() and not flight.task.done():
+            # Qayta kodlash boshlangan: oxirigacha bajarilib, keshga tushsin; yangi so'rovlar unga qo'shiladi
+            flight.lingering = True
+            flight.task.add_done_callback(lambda _: self._linger_done(key, flight))
+            return
+        self._finish(key, flight)
+
+    def _linger_done(self, key: str, flight: _Flight) -> None:
+        flight.lingering = False
+        if flight.refs <= 0:
+            self._finish(key, flight)
+
+    def _finish(self, key: str, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if self._cache:
+            self._cache.unpin(key)
+        if flight.task.done():
+            with timer("cleanup"):
+                self._cleanup_result(flight.task)
+        else:
+            # Hech kim kutmayapti — yuklashni to'xtatamiz (runner fayl qoldiqlarini tozalaydi)
+            flight.task.cancel()
+
+    def _cleanup_result(self, task: asyncio.Future) -> None:
+        if self._cache or task.cancelled() or task.exception() is not None:
+            return
+        self._cleanup(task.result())
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+
+# Barcha handlerlar uchun umumiy yuklash guruhi
+downloads = SingleFlight(postprocess=transcoder.fit)
@@ -0,0 +1,55 @@
+import asyncio
+
+from rate_limiter import TelegramRateLimiter
+
+
+def test_rapid_edits_of_one_message_all_return():
+    """Several edits queued behind a busy group chat: only the newest is sent, every caller gets its result."""
+
+    async def scenario():
+        limiter = TelegramRateLimiter(global_rate=1000, group_rate_per_min=600)
+        sent = []
+
+        async def call(name):
+            sent.append(name)
+            return name
+
+        # Guruh chati burst'ini tugatamiz — keyingi tahrirlar navbatda turadi
+        for i in range(3):
+            await limiter.process_request(call, (f"send{i}",), {}, "sendMessage", {"chat_id": -100}, None)
+        edits = []
+        for i in range(4):
+            edits.append(asyncio.create_task(limiter.process_request(
+                call, (f"e{i}",), {}, "editMessageText", {"chat_id": -100, "message_id": 5}, None)))
+            await asyncio.sleep(0.01)
+        results = await asyncio.wait_for(asyncio.gather(*edits), 5)
+        return sent, results
+
+    sent, results = asyncio.run(scenario())
+    assert sent == ["send0", "send1", "send2", "e3"]
+    assert results == ["e3"] * 4
+
+
+def test_edit_falls_back_when_newest_fails():
+    async def scenario():
+        limiter = TelegramRateLimiter(global_rate=1000, group_rate_per_min=600)
+        sent = []
+
+        async def call(name):
+            sent.append(name)
+            if name == "e2":
+                raise RuntimeError("boom")
+            return name
+
+        for i in range(3):
+            await limiter.process_request(call, (f"send{i}",), {}, "sendMessage", {"chat_id": -100}, None)
+        edits = []
+        for i in range(3):
+            edits.append(asyncio.create_task(limiter.process_request(
+                call, (f"e{i}",), {}, "editMessageText", {"chat_id": -100, "message_id": 5}, None)))
+            await asyncio.sleep(0.01)
+        return await asyncio.wait_for(asyncio.gather(*edits, return_exceptions=True), 10)
+
+    results = asyncio.run(scenario())
+    assert isinstance(results[2], RuntimeError)
+    assert results[:2] == ["e0", "e1"]
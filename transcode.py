@@ -0,0 +1,170 @@
+import asyncio
+import contextlib
+import logging
+import os
+
+from formats import MAX_UPLOAD_BYTES, ffmpeg_tool
+from metrics import Counter, Gauge, timer
+from workers import BOT_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Bir vaqtda ishlaydigan ffmpeg jarayonlari (standart: CPU yadrolari worker'lar orasida bo'lingan)
+TRANSCODE_WORKERS = int(os.environ.get("TRANSCODE_WORKERS", str(max(1, (os.cpu_count() or 1) // BOT_WORKERS))))
+# Bo'sh joy kutayotganlar shundan oshsa, fayl qayta kodlanmaydi (foydalanuvchi "juda katta" javobini oladi)
+TRANSCODE_MAX_QUEUED = int(os.environ.get("TRANSCODE_MAX_QUEUED", "10"))
+TRANSCODE_TIMEOUT = float(os.environ.get("TRANSCODE_TIMEOUT", "600"))
+# aac (.m4a, Telegram pleerida ijro etiladi) yoki opus (.ogg, past bitreytda sifatliroq)
+TRANSCODE_CODEC = os.environ.get("TRANSCODE_CODEC", "aac")
+TRANSCODE_MAX_KBPS = int(os.environ.get("TRANSCODE_MAX_KBPS", "192"))
+TRANSCODE_MIN_KBPS = int(os.environ.get("TRANSCODE_MIN_KBPS", "32"))
+
+_CODECS = {"aac": ("aac", ".m4a"), "opus": ("libopus", ".ogg")}
+# Konteyner va VBR uchun zaxira; natija baribir katta bo'lsa, bir marta pastroq bitreyt bilan qayta uriniladi
+_TARGET_RATIO = 0.95
+_RETRY_RATIO = 0.85
+
+TRANSCODES = Counter("bot_transcode_total", "Oversized audio re-encodes by result (ok, failed, timeout, rejected, too_long)")
+
+
+def target_kbps(duration: float, limit: int = MAX_UPLOAD_BYTES) -> int:
+    """Audio bitrate (kbit/s) at which duration seconds fill about 95% of limit bytes."""
+    return min(TRANSCODE_MAX_KBPS, int(limit * _TARGET_RATIO * 8 / duration / 1000))
+
+
+class Transcoder:
+    """Re-encodes downloaded audio that exceeds the upload limit with ffmpeg.
+
+    Each ffmpeg run is a separate OS process, started from the event loop
+    rather than the download threads. At most ``workers`` run at once; up to
+    ``max_queued`` more wait for a slot and the rest are returned unchanged.
+    A run that exceeds ``timeout`` (or whose requester goes away) is killed.
+    The bitrate is derived from the duration reported by ffprobe.
+    """
+
+    def __init__(self, workers: int = TRANSCODE_WORKERS, max_queued: int = TRANSCODE_MAX_QUEUED,
+                 timeout: float = TRANSCODE_TIMEOUT, codec: str = TRANSCODE_CODEC):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.codec, self.ext = _CODECS.get(codec, _CODECS["aac"])
+        self._slots: asyncio.Semaphore | None = None
+        self.running = 0
+        self.queued = 0
+
+    async def fit(self, key: str, path: str, started=None) -> str:
+        """SingleFlight postprocess hook: shrink an oversized ``*:audio`` download, else return path as is.
+
+        ``started()`` is called once the file is accepted for re-encoding.
+        """
+        if not key.endswith(":audio"):
+            return path
+        try:
+            if os.path.getsize(path) <= MAX_UPLOAD_BYTES:
+                return path
+        except OSError:
+            return path
+        if self.queued >= self.max_queued:
+            logger.warning("Transcode navbati to'la — %s qayta kodlanmaydi", key)
+            TRANSCODES.inc(result="rejected")
+            return path
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        if started is not None:
+            started()
+        self.queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        self.running += 1
+        try:
+            with timer("transcode"):
+                return await self._fit(key, path)
+        finally:
+            self.running -= 1
+            self._slots.release()
+
+    async def _fit(self, key: str, path: str) -> str:
+        duration = await self._duration(path)
+        if not duration:
+            TRANSCODES.inc(result="failed")
+            return path
+        kbps = target_kbps(duration)
+        if kbps < TRANSCODE_MIN_KBPS:
+            logger.info("%s juda uzun (%.0f s) — %d kbps sifat uchun yetarli emas", key, duration, kbps)
+            TRANSCODES.inc(result="too_long")
+            return path
+        output = os.path.splitext(path)[0] + ".fit" + self.ext
+        fitted = False
+        try:
+            for attempt_kbps in (kbps, int(kbps * _RETRY_RATIO)):
+                if not await self._encode(path, output, attempt_kbps):
+                    break
+                if os.path.getsize(output) <= MAX_UPLOAD_BYTES:
+                    fitted = True
+                    break
+        except asyncio.TimeoutError:
+            logger.warning("Transcode %s %ss ichida tugamadi", key, self.timeout)
+            TRANSCODES.inc(result="timeout")
+            return path
+        finally:
+            # Xato, timeout yoki bekor qilinganda chala natija qolmasin
+            if not fitted and os.path.exists(output):
+                os.remove(output)
+        if not fitted:
+            TRANSCODES.inc(result="failed")
+            return path
+        logger.info("%s qayta kodlandi: %d kbps, %.1f MB -> %.1f MB", key, attempt_kbps,
+                    os.path.getsize(path) / (1024 * 1024), os.path.getsize(output) / (1024 * 1024))
+        os.remove(path)
+        TRANSCODES.inc(result="ok")
+        return output
+
+    async def _duration(self, path: str) -> float | None:
+        try:
+            code, out = await self._run(
+                ffmpeg_tool("ffprobe"), "-v", "error", "-show_entries", "format=duration",
+                "-of", "default=noprint_wrappers=1:nokey=1", path, timeout=30,
+            )
+        except asyncio.TimeoutError:
+            return None
+        try:
+            return float(out) if code == 0 else None
+        except ValueError:
+            return None
+
+    async def _encode(self, source: str, output: str, kbps: int) -> bool:
+        code, _ = await self._run(
+            ffmpeg_tool("ffmpeg"), "-nostdin", "-v", "error", "-y", "-i", source,
+            "-vn", "-map_metadata", "0", "-c:a", self.codec, "-b:a", f"{kbps}k", output,
+            timeout=self.timeout,
+        )
+        return code == 0
+
+    async def _run(self, *args: str, timeout: float) -> tuple[int, str]:
+        """Run a command; kill it on timeout or cancellation. Returns (exit code, stdout)."""
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+            )
+        except OSError as e:
+            logger.error("%s ishga tushmadi: %s", args[0], e)
+            return -1, ""
+        try:
+            out, err = await asyncio.wait_for(process.communicate(), timeout)
+        except BaseException:
+            with contextlib.suppress(ProcessLookupError):
+                process.kill()
+            await process.wait()
+            raise
+        if process.returncode:
+            logger.warning("%s xato bilan tugadi (%d): %s", os.path.basename(args[0]), process.returncode,
+                           err.decode(errors="replace").strip()[-300:])
+        return process.returncode, out.decode().strip()
+
+
+transcoder = Transcoder()
+
+Gauge("bot_transcodes_running", "ffmpeg re-encodes currently running", lambda: transcoder.running)
+Gauge("bot_transcode_queue_depth", "Re-encodes waiting for a free ffmpeg slot", lambda: transcoder.queued)
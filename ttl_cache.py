@@ -0,0 +1,56 @@
+import threading
+import time
+from collections import OrderedDict
+
+# get() returns this when the key is absent or expired (None is a valid cached value)
+MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe bounded LRU cache with per-entry expiry.
+
+    Safe to use from both the event loop and asyncio.to_thread workers.
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: float = 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        """Return the cached value and mark it recently used, or default."""
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] <= now:
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl: float | None = None) -> None:
+        """Store value for ttl seconds (defaults to the cache TTL), evicting LRU entries."""
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,81 @@
+import asyncio
+import logging
+import os
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Turli chatlardan bir vaqtda nechta update ishlanadi
+MAX_CONCURRENT_UPDATES = int(os.environ.get("MAX_CONCURRENT_UPDATES", "32"))
+
+# Bu buyruqlar hech qachon yuklashlar ortida navbat kutmaydi
+FAST_PATH_COMMANDS = {"/ping", "/start"}
+
+# Base class semaphore only caps updates *waiting* for their chat; the real
+# concurrency limit is applied after the per-chat lock is taken.
+_MAX_PENDING_UPDATES = 10_000
+
+
+def _command(update: object) -> str | None:
+    """Return the leading bot command of a message (without @botname), if any."""
+    if not isinstance(update, Update) or not update.message or not update.message.text:
+        return None
+    first = update.message.text.split(maxsplit=1)[0]
+    if not first.startswith("/"):
+        return None
+    return first.split("@", 1)[0].lower()
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Process updates from different chats in parallel, keeping each chat in order.
+
+    At most ``max_workers`` handlers run at once. Updates of one chat wait for
+    the previous one to finish before they take a worker slot, so a long
+    download in one chat never occupies more than one slot. Commands in
+    FAST_PATH_COMMANDS and inline queries skip both the chat lock and the
+    worker limit.
+    """
+
+    def __init__(self, max_workers: int = MAX_CONCURRENT_UPDATES):
+        super().__init__(_MAX_PENDING_UPDATES)
+        self.max_workers = max_workers
+        self._workers = asyncio.BoundedSemaphore(max_workers)
+        # chat_id -> [lock, number of updates holding or waiting for it]
+        self._chats: dict[int, list] = {}
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        if _command(update) in FAST_PATH_COMMANDS:
+            await coroutine
+            return
+        # Inline so'rovlar hech narsa yuklamaydi (sovuq natijalar fonda) va debounce paytida uxlaydi
+        if isinstance(update, Update) and update.inline_query:
+            await coroutine
+            return
+
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            async with self._workers:
+                await coroutine
+            return
+
+        entry = self._chats.get(chat.id)
+        if entry is None:
+            entry = self._chats[chat.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # asyncio.Lock wakes waiters in FIFO order, so a chat's updates keep their order
+            async with entry[0]:
+                async with self._workers:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._chats.pop(chat.id, None)
+
+    async def initialize(self) -> None:
+        logger.info("Update processor: %d parallel chats", self.max_workers)
+
+    async def shutdown(self) -> None:
+        self._chats.clear()
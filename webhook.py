@@ -0,0 +1,108 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import signal
+
+from telegram import Update
+from telegram.ext import Application
+
+from webserver import WebServer, Request, Response
+from metrics import render
+from readiness import readiness
+
+logger = logging.getLogger(__name__)
+
+# Webhook rejimi sozlamalari (BOT_MODE=webhook bo'lganda)
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")  # masalan: https://mybot.up.railway.app
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", "40"))
+PORT = int(os.environ.get("PORT", "8080"))
+
+
+def webhook_secret(token: str) -> str:
+    """Secret for X-Telegram-Bot-Api-Secret-Token; derived from the bot token if not configured."""
+    return WEBHOOK_SECRET or hashlib.sha256(token.encode()).hexdigest()[:48]
+
+
+def add_webhook_route(server: WebServer, application: Application, secret: str) -> None:
+    """Accept Telegram updates on WEBHOOK_PATH and queue them for the Application."""
+
+    async def receive(request: Request) -> Response:
+        given = request.headers.get("x-telegram-bot-api-secret-token", "")
+        if not hmac.compare_digest(given.encode(), secret.encode()):
+            return Response(403, "forbidden")
+        try:
+            data = json.loads(request.body)
+            update = Update.de_json(data, application.bot)
+        except Exception as e:
+            logger.warning("Webhook: noto'g'ri update: %s", e)
+            return Response(400, "bad update")
+        # Darhol javob qaytaramiz — ishlov berish Application navbatida
+        application.update_queue.put_nowait(update)
+        return Response(200, "ok")
+
+    server.route("POST", WEBHOOK_PATH, receive)
+
+
+def add_metrics_route(server: WebServer) -> None:
+    """Expose Prometheus metrics on GET /metrics."""
+
+    async def metrics(request: Request) -> Response:
+        return Response(200, render(), "text/plain; version=0.0.4; charset=utf-8")
+
+    server.route("GET", "/metrics", metrics)
+
+
+def add_ready_route(server: WebServer) -> None:
+    """Expose GET /ready: 200 once warm-up and Telegram startup are done, 503 until then."""
+
+    async def ready(request: Request) -> Response:
+        if readiness.is_ready:
+            return Response(200, "ready\n")
+        return Response(503, "starting: " + ", ".join(readiness.pending()) + "\n")
+
+    server.route("GET", "/ready", ready)
+
+
+async def run_webhook(application: Application, token: str, server: WebServer | None = None) -> None:
+    """Run the bot in webhook mode until SIGINT/SIGTERM."""
+    if not WEBHOOK_URL:
+        raise SystemExit("WEBHOOK_URL environment variable is not set (BOT_MODE=webhook).")
+    secret = webhook_secret(token)
+    server = server or WebServer(port=PORT)
+    add_webhook_route(server, application, secret)
+    add_metrics_route(server)
+    add_ready_route(server)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await server.start()
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=secret,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=True,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+        logger.info("Bot ishga tushdi (webhook): %s%s", WEBHOOK_URL.rstrip("/"), WEBHOOK_PATH)
+        try:
+            await stop.wait()
+        finally:
+            await server.stop()
+            await application.stop()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
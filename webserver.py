@@ -0,0 +1,153 @@
+import asyncio
+import logging
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 2 * 1024 * 1024
+# Bo'sh turgan keep-alive ulanishni qancha ushlab turamiz
+IDLE_TIMEOUT = 75
+
+_REASONS = {
+    200: "OK", 204: "No Content", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+    405: "Method Not Allowed", 413: "Payload Too Large", 429: "Too Many Requests", 500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class Request:
+    __slots__ = ("method", "path", "query", "headers", "body")
+
+    def __init__(self, method: str, path: str, query: str, headers: dict, body: bytes):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+
+class Response:
+    __slots__ = ("status", "body", "content_type")
+
+    def __init__(self, status: int = 200, body: bytes | str = b"", content_type: str = "text/plain; charset=utf-8"):
+        self.status = status
+        self.body = body.encode() if isinstance(body, str) else body
+        self.content_type = content_type
+
+
+class WebServer:
+    """Tiny asyncio HTTP/1.1 server for the webhook and service endpoints.
+
+    Supports keep-alive and Content-Length bodies only, which is all Telegram
+    and Prometheus-style scrapers need; no extra dependency required.
+    """
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 8080):
+        self.host = host
+        self.port = port
+        self._routes: dict[tuple[str, str], object] = {}
+        self._server: asyncio.AbstractServer | None = None
+        self._connections: dict[asyncio.StreamWriter, asyncio.Task] = {}
+
+    def route(self, method: str, path: str, handler) -> None:
+        """Register ``async handler(request) -> Response`` for method and path."""
+        self._routes[(method.upper(), path)] = handler
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port, limit=MAX_HEADER_BYTES
+        )
+        logger.info("HTTP server %s:%d da tinglamoqda", self.host, self.port)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            # Ochiq keep-alive ulanishlarni yopamiz, aks holda ular loop yopilganda bekor qilinadi
+            for writer in list(self._connections):
+                writer.close()
+            if self._connections:
+                await asyncio.wait(list(self._connections.values()), timeout=5)
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), timeout=IDLE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if request is None:
+                    break
+                if isinstance(request, Response):
+                    await self._write(writer, request, keep_alive=False)
+                    break
+                response = await self._dispatch(request)
+                keep_alive = request.headers.get("connection", "").lower() != "close"
+                await self._write(writer, response, keep_alive)
+                if not keep_alive:
+                    break
+        except Exception as e:
+            logger.debug("HTTP ulanish xatosi: %s", e)
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        """Parse one request; returns None on EOF or an error Response for bad input."""
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            return Response(413, "headers too large")
+        except asyncio.IncompleteReadError as e:
+            if not e.partial:
+                return None
+            raise
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _version = lines[0].split(" ", 2)
+        except ValueError:
+            return Response(400, "bad request line")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length", "0"))
+        except ValueError:
+            return Response(400, "bad content-length")
+        if length > MAX_BODY_BYTES:
+            return Response(413, "body too large")
+        body = await reader.readexactly(length) if length else b""
+        url = urlsplit(target)
+        return Request(method.upper(), url.path, url.query, headers, body)
+
+    async def _dispatch(self, request: Request) -> Response:
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            if any(path == request.path for _, path in self._routes):
+                return Response(405, "method not allowed")
+            return Response(404, "not found")
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.error("HTTP handler xatosi (%s %s): %s", request.method, request.path, e, exc_info=True)
+            return Response(500, "internal error")
+
+    @staticmethod
+    async def _write(writer: asyncio.StreamWriter, response: Response, keep_alive: bool) -> None:
+        head = (
+            f"HTTP/1.1 {response.status} {_REASONS.get(response.status, 'OK')}\r\n"
+            f"Content-Type: {response.content_type}\r\n"
+            f"Content-Length: {len(response.body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + response.body)
+        await writer.drain()
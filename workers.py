@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+
+logger = logging.getLogger(__name__)
+
+# Worker jarayonlar soni; 1 — oddiy bitta jarayonli rejim
+BOT_WORKERS = int(os.environ.get("BOT_WORKERS", "1"))
+# To'xtatishda har bir worker navbatidagi update'larni tugatishi uchun vaqt
+WORKER_STOP_TIMEOUT = float(os.environ.get("WORKER_STOP_TIMEOUT", "60"))
+
+# spawn: ingest jarayonidagi thread/ulanishlar worker'larga meros qolmaydi
+_MP = multiprocessing.get_context("spawn")
+
+
+def shard_key(update: Update) -> int:
+    """Chat id the update belongs to (user id for chat-less updates such as inline queries)."""
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return update.update_id
+
+
+def _read_queue(updates, loop: asyncio.AbstractEventLoop, deliver, parent_pid: int) -> None:
+    """Worker thread: move raw updates from the process queue onto the event loop."""
+    while True:
+        try:
+            data = updates.get(timeout=1)
+        except queue.Empty:
+            # Ingest jarayoni o'lib qolgan bo'lsa — to'xtaymiz
+            if os.getppid() == parent_pid:
+                continue
+            data = None
+        loop.call_soon_threadsafe(deliver, data)
+        if data is None:
+            return
+
+
+async def _serve(application: Application, updates, parent_pid: int) -> None:
+    stopped = asyncio.Event()
+
+    def deliver(data) -> None:
+        if data is None:
+            stopped.set()
+        else:
+            application.update_queue.put_nowait(Update.de_json(data, application.bot))
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        reader = threading.Thread(
+            target=_read_queue, args=(updates, asyncio.get_running_loop(), deliver, parent_pid),
+            name="update-reader", daemon=True,
+        )
+        reader.start()
+        await stopped.wait()
+        # Application.stop() navbatda qolgan update'larni ham ishlab bo'ladi
+        await application.stop()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def run_worker(token: str, index: int, updates, parent_pid: int, builder_options: dict) -> None:
+    """Entry point of a worker process: run the regular handlers on updates from its queue."""
+    # To'xtatishni ingest jarayoni boshqaradi (navbatga None yuboradi)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    from bot import build_application
+
+    application = build_application(token, updater=None, **builder_options)
+    logger.info("Worker %d ishga tushdi (pid %d)", index, os.getpid())
+    asyncio.run(_serve(application, updates, parent_pid))
+
+
+class WorkerPool:
+    """N worker processes, each fed by its own queue; updates are sharded by chat id.
+
+    One chat always maps to the same worker, so per-chat ordering (see
+    update_processor) and callback buttons created by that chat keep working.
+    A worker that died is restarted on the next update routed to it with a
+    fresh queue: a killed process may still hold the old queue's read lock,
+    so updates that were waiting in it are dropped.
+    """
+
+    def __init__(self, token: str, count: int = BOT_WORKERS, **builder_options):
+        self.token = token
+        self.count = count
+        self.builder_options = builder_options
+        self._queues = [_MP.Queue() for _ in range(count)]
+        self._processes: list = [None] * count
+
+    def _spawn(self, index: int) -> None:
+        env = {
+            "BOT_MODE": "worker",
+            "DOWNLOAD_SCRATCH_DIR": os.path.join("downloads", f"w{index}"),
+            "DISK_CACHE_DIR": os.path.join("downloads", "cache", f"w{index}"),
+        }
+        if os.environ.get("METRICS_PORT"):
+            env["METRICS_PORT"] = str(int(os.environ["METRICS_PORT"]) + 1 + index)
+        # spawn qilingan jarayon ota-jarayonning os.environ nusxasini oladi
+        saved = {name: os.environ.get(name) for name in env}
+        os.environ.update(env)
+        try:
+            process = _MP.Process(
+                target=run_worker, args=(self.token, index, self._queues[index], os.getpid(), self.builder_options),
+                name=f"bot-worker-{index}",
+            )
+            process.start()
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+        self._processes[index] = process
+
+    def start(self) -> None:
+        for index in range(self.count):
+            self._spawn(index)
+        logger.info("%d ta worker jarayoni ishga tushirildi", self.count)
+
+    def dispatch(self, update: Update) -> None:
+        index = shard_key(update) % self.count
+        process = self._processes[index]
+        if process is None or not process.is_alive():
+            if process is not None:
+                logger.warning("Worker %d ishlamayapti (exitcode=%s) — qayta ishga tushiramiz",
+                               index, process.exitcode)
+                self._queues[index] = _MP.Queue()
+            self._spawn(index)
+        self._queues[index].put(update.to_dict())
+
+    def stop(self, timeout: float = WORKER_STOP_TIMEOUT) -> None:
+        """Ask every worker to finish its queue and exit; terminate stragglers."""
+        for updates in self._queues:
+            updates.put(None)
+        for process in self._processes:
+            if process is None:
+                continue
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning("%s %ss ichida to'xtamadi — majburan to'xtatilmoqda", process.name, timeout)
+                process.terminate()
+                process.join(5)
+
+
+def build_ingest_application(token: str, pool: WorkerPool, **builder_options) -> Application:
+    """Application that only receives updates (polling or webhook) and hands them to the pool."""
+
+    async def forward(update: Update, context) -> None:
+        pool.dispatch(update)
+
+    builder = Application.builder().token(token)
+    for name, value in builder_options.items():
+        builder = getattr(builder, name)(value)
+    application = builder.build()
+    application.add_handler(TypeHandler(Update, forward))
+    return application
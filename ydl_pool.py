@@ -0,0 +1,91 @@
+import logging
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Har bir profil uchun bo'sh turgan YoutubeDL instansiyalari soni
+POOL_MAX_IDLE = int(os.environ.get("YDL_POOL_MAX_IDLE", "4"))
+
+_POOLS: list["YDLPool"] = []
+
+
+class _PooledYDL:
+    """A long-lived YoutubeDL plus a per-checkout progress hook slot."""
+
+    def __init__(self, opts: dict):
+        # yt_dlp (butun extractor ro'yxati bilan) birinchi instansiya yaratilganda yuklanadi —
+        # odatda fondagi warm-up'da, bot ishga tushishini kechiktirmaydi
+        import yt_dlp
+
+        self.hook = None
+        # Doimiy hook: joriy checkout'ning hook'iga yo'naltiradi
+        self.ydl = yt_dlp.YoutubeDL({**opts, 'progress_hooks': [self._on_progress]})
+
+    def _on_progress(self, status: dict) -> None:
+        if self.hook is not None:
+            self.hook(status)
+
+
+class YDLPool:
+    """Pool of reusable YoutubeDL instances sharing one option profile.
+
+    An instance is used by one thread at a time (thread-safe by checkout) and
+    keeps its extractors, cookie jar and keep-alive HTTP connections between
+    calls. Instances that raised are closed instead of returned to the pool.
+    """
+
+    def __init__(self, name: str, opts: dict, max_idle: int = POOL_MAX_IDLE, warm_extractors=()):
+        self.name = name
+        self.opts = opts
+        self.max_idle = max_idle
+        self.warm_extractors = tuple(warm_extractors)
+        self.created = 0
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._lock = threading.Lock()
+        _POOLS.append(self)
+
+    def _create(self) -> _PooledYDL:
+        item = _PooledYDL(self.opts)
+        for ie_key in self.warm_extractors:
+            # Extractor obyektini oldindan yaratib qo'yamiz (import + initialize)
+            item.ydl.get_info_extractor(ie_key)
+        with self._lock:
+            self.created += 1
+        return item
+
+    @contextmanager
+    def checkout(self, progress_hook=None):
+        """Borrow a YoutubeDL for one call; ``progress_hook`` gets this call's progress."""
+        try:
+            item = self._idle.get_nowait()
+        except queue.Empty:
+            item = self._create()
+        item.hook = progress_hook
+        try:
+            yield item.ydl
+        except BaseException:
+            item.hook = None
+            item.ydl.close()
+            raise
+        item.hook = None
+        if self._idle.qsize() < self.max_idle:
+            self._idle.put(item)
+        else:
+            item.ydl.close()
+
+    def warm_up(self, count: int = 1) -> None:
+        for _ in range(max(0, count - self._idle.qsize())):
+            self._idle.put(self._create())
+
+
+def warm_up_pools(count: int = 1) -> None:
+    """Pre-create ``count`` idle instances in every registered pool."""
+    for pool in _POOLS:
+        try:
+            pool.warm_up(count)
+        except Exception as e:
+            logger.warning("YoutubeDL pool '%s' tayyorlanmadi: %s", pool.name, e)
+    logger.info("YoutubeDL pools warmed: %s", ", ".join(p.name for p in _POOLS))
@@ -1,7 +1,92 @@
-import yt_dlp
 import os
+import re
+import subprocess
+import time
+import unicodedata
+from ttl_cache import TTLCache, MISSING
+from cancellation import CancelHook
+from ydl_pool import YDLPool
+from disk_cache import SCRATCH_DIR
+from metrics import timer, Gauge, BYTES_DOWNLOADED
+import chunked
+from formats import select_audio_format, FFMPEG_LOCATION, ffmpeg_tool
 
-def _ensure_download_dir(path: str = "downloads") -> str:
+# youtu.be/<id>, watch?v=<id>, shorts/<id>, embed/<id>, live/<id>
+_VIDEO_ID_RE = re.compile(r"(?:youtu\.be/|[?&]v=|/shorts/|/embed/|/live/)([A-Za-z0-9_-]{11})")
+_PLAYLIST_ID_RE = re.compile(r"youtube\.com/.*[?&]list=([A-Za-z0-9_-]+)")
+
+# Pleylistdan ko'pi bilan nechta trek olinadi
+PLAYLIST_MAX_ITEMS = int(os.environ.get("PLAYLIST_MAX_ITEMS", "50"))
+
+# Matnli qidiruvda avval shuncha soniyalik parcha yuboriladi (0 — o'chirilgan, darhol to'liq trek)
+PREVIEW_SECONDS = int(os.environ.get("PREVIEW_SECONDS", "30"))
+PREVIEW_TIMEOUT = float(os.environ.get("PREVIEW_TIMEOUT", "15"))
+
+# Qidiruv natijalari keshi: bir xil qo'shiq nomi uchun qayta-qayta ytsearch qilmaymiz
+SEARCH_CACHE_TTL = float(os.environ.get("SEARCH_CACHE_TTL", "3600"))
+SEARCH_CACHE_NEGATIVE_TTL = float(os.environ.get("SEARCH_CACHE_NEGATIVE_TTL", "300"))
+SEARCH_CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", "2000"))
+SEARCH_CACHE = TTLCache(max_size=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+Gauge("bot_search_cache_hits", "YouTube search cache hits since start", lambda: SEARCH_CACHE.hits)
+Gauge("bot_search_cache_misses", "YouTube search cache misses since start", lambda: SEARCH_CACHE.misses)
+
+# O'zbek/rus kirill -> lotin, so'ng apostroflar olib tashlanadi ("ғ" ~ "g'" ~ "g")
+_CYRILLIC_TO_LATIN = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "ғ": "g", "д": "d", "е": "e", "ё": "yo",
+    "ж": "j", "з": "z", "и": "i", "й": "y", "к": "k", "қ": "q", "л": "l", "м": "m",
+    "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ў": "o",
+    "ф": "f", "х": "x", "ҳ": "h", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "sh", "ъ": "",
+    "ы": "i", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+}
+_TRANSLIT_TABLE = str.maketrans(_CYRILLIC_TO_LATIN)
+
+# Uzoq yashaydigan YoutubeDL instansiyalari (har profil uchun alohida pool).
+# Qidiruv so'rovlari "ytsearchN:" prefiksi bilan yuboriladi.
+SEARCH_POOL = YDLPool("yt_search", {
+    'format': 'bestaudio/best',
+    'noplaylist': True,
+    'quiet': True,
+    'no_warnings': True,
+    'extract_flat': True,
+    'socket_timeout': 15,
+    'retries': 3,
+    'fixup': 'never',
+    'ffmpeg_location': FFMPEG_LOCATION,
+}, warm_extractors=("YoutubeSearch",))
+
+PLAYLIST_POOL = YDLPool("yt_playlist", {
+    # Faqat ro'yxat (id + nom) — har bir video sahifasi ochilmaydi
+    'extract_flat': 'in_playlist',
+    'playlistend': PLAYLIST_MAX_ITEMS,
+    'quiet': True,
+    'no_warnings': True,
+    'socket_timeout': 15,
+    'retries': 3,
+}, warm_extractors=("YoutubeTab",))
+
+AUDIO_POOL = YDLPool("yt_audio", {
+    # Prefer AAC/M4A, then fallback to best available — within the Telegram size limit
+    'format': select_audio_format,
+    'noplaylist': True,
+    'quiet': True,
+    'no_warnings': True,
+    'outtmpl': os.path.join(SCRATCH_DIR, '%(id)s.%(ext)s'),
+    'socket_timeout': 30,
+    'retries': 3,
+    'nocheckcertificate': True,
+    'fixup': 'never',
+    'ffmpeg_location': FFMPEG_LOCATION,
+    # DASH/HLS bo'laklari parallel yuklanadi
+    'concurrent_fragment_downloads': chunked.DOWNLOAD_CONNECTIONS,
+}, warm_extractors=("Youtube",))
+
+def _count_downloaded(path: str, source: str) -> None:
+    try:
+        BYTES_DOWNLOADED.inc(os.path.getsize(path), source=source)
+    except OSError:
+        pass
+
+def _ensure_download_dir(path: str = SCRATCH_DIR) -> str:
     if not os.path.isdir(path):
         try:
             os.makedirs(path, exist_ok=True)
@@ -10,86 +95,146 @@ def _ensure_download_dir(path: str = "downloads") -> str:
             return ""
     return path
 
+def extract_video_id(url: str) -> str | None:
+    """Return the 11-char YouTube video id from a link, or None if not found."""
+    match = _VIDEO_ID_RE.search(url or "")
+    return match.group(1) if match else None
+
+def extract_playlist_id(url: str) -> str | None:
+    """Playlist id of a YouTube playlist link; None for a single video shared from a playlist."""
+    match = _PLAYLIST_ID_RE.search(url or "")
+    if not match or extract_video_id(url):
+        return None
+    return match.group(1)
+
+_APOSTROPHES = "\u02bb\u02bc"
+
+def normalize_query(query: str) -> str:
+    """Normalize a search query for cache lookups.
+
+    Lowercases, transliterates Cyrillic Uzbek/Russian to Latin, drops
+    punctuation (including o'/g' apostrophes) and collapses whitespace, so
+    "Shahzoda - Ёмғир" and "shahzoda yomg'ir" share one entry.
+    """
+    text = unicodedata.normalize("NFKC", query or "").lower().translate(_TRANSLIT_TABLE)
+    # ʻ/ʼ (U+02BB/U+02BC, rasmiy o'zbek lotin yozuvi) isalnum() uchun harf — ularni ham tashlaymiz
+    text = "".join(
+        ch if ch.isalnum() and ch not in _APOSTROPHES else (" " if ch.isspace() or ch in "-_/|.,:;" else "")
+        for ch in text
+    )
+    # Faqat emoji/belgilardan iborat so'rovlar bitta bo'sh kalitga tushib qolmasin
+    return " ".join(text.split()) or (query or "").strip()
+
 def search_youtube(query):
     """Search YouTube and return top entries quickly.
     Prefer flat extraction to speed up search.
     """
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'default_search': 'ytsearch3',
-        'noplaylist': True,
-        'quiet': True,
-        'no_warnings': True,
-        'extract_flat': True,
-        'socket_timeout': 15,
-        'retries': 3,
-        'fixup': 'never',
-        'ffmpeg_location': 'ffmpeg',
-    }
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(query, download=False)
-        return info.get('entries', [])
+    cache_key = ("list", normalize_query(query))
+    cached = SEARCH_CACHE.get(cache_key)
+    if cached is not MISSING:
+        return list(cached)
+    with timer("search", kind="list"), SEARCH_POOL.checkout() as ydl:
+        info = ydl.extract_info(f"ytsearch3:{query}", download=False)
+        entries = list(info.get('entries') or [])
+    SEARCH_CACHE.set(cache_key, entries, ttl=None if entries else SEARCH_CACHE_NEGATIVE_TTL)
+    return list(entries)
 
 def search_top_video_id(query):
     """Return top YouTube video id and title for a text query (fast)."""
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'default_search': 'ytsearch1',
-        'noplaylist': True,
-        'quiet': True,
-        'no_warnings': True,
-        'extract_flat': True,
-        'socket_timeout': 15,
-        'retries': 3,
-        'fixup': 'never',
-        'ffmpeg_location': 'ffmpeg',
-    }
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(query, download=False)
+    cache_key = ("top", normalize_query(query))
+    cached = SEARCH_CACHE.get(cache_key)
+    if cached is not MISSING:
+        return cached
+    with timer("search", kind="top"), SEARCH_POOL.checkout() as ydl:
+        info = ydl.extract_info(f"ytsearch1:{query}", download=False)
         entries = info.get('entries', [])
-        if entries:
-            entry = entries[0]
-            return entry.get('id'), entry.get('title')
-        return None, None
+    if entries:
+        entry = entries[0]
+        result = (entry.get('id'), entry.get('title'))
+        SEARCH_CACHE.set(cache_key, result)
+        return result
+    # Negative caching: "topilmadi" ham qisqa muddat eslab qolinadi
+    SEARCH_CACHE.set(cache_key, (None, None), ttl=SEARCH_CACHE_NEGATIVE_TTL)
+    return None, None
+
+def list_playlist(playlist_id: str) -> list[dict]:
+    """Return up to PLAYLIST_MAX_ITEMS playlist entries as {'id', 'title'} dicts, in order."""
+    cache_key = ("playlist", playlist_id)
+    cached = SEARCH_CACHE.get(cache_key)
+    if cached is not MISSING:
+        return list(cached)
+    with timer("search", kind="playlist"), PLAYLIST_POOL.checkout() as ydl:
+        info = ydl.extract_info(f"https://www.youtube.com/playlist?list={playlist_id}", download=False)
+    entries = [
+        {"id": entry["id"], "title": entry.get("title") or entry["id"]}
+        for entry in (info or {}).get("entries") or []
+        if entry and entry.get("id")
+    ][:PLAYLIST_MAX_ITEMS]
+    SEARCH_CACHE.set(cache_key, entries, ttl=None if entries else SEARCH_CACHE_NEGATIVE_TTL)
+    return list(entries)
+
+def download_preview(video_id, cancel_event=None, seconds=PREVIEW_SECONDS):
+    """Encode the first seconds of a track's best audio stream as an OGG/Opus voice clip.
+
+    ffmpeg reads the stream URL itself and stops after the window, so only
+    the leading part of the file is fetched. Returns the clip path.
+    """
+    hook = CancelHook(cancel_event)
+    hook.check()
+    _ensure_download_dir(SCRATCH_DIR)
+    with timer("download", source="youtube_preview"):
+        with AUDIO_POOL.checkout() as ydl:
+            info = ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False)
+        if not info.get("url"):
+            raise ValueError(f"no direct audio stream for {video_id}")
+        output = os.path.join(SCRATCH_DIR, f"{info['id']}.preview.ogg")
+        headers = "".join(f"{name}: {value}\r\n" for name, value in (info.get("http_headers") or {}).items())
+        process = subprocess.Popen(
+            [ffmpeg_tool("ffmpeg"), "-nostdin", "-v", "error", "-y", "-headers", headers,
+             "-t", str(seconds), "-i", info["url"], "-vn", "-c:a", "libopus", "-b:a", "64k", output],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        )
+        deadline = time.monotonic() + PREVIEW_TIMEOUT
+        try:
+            while process.poll() is None:
+                hook.check()
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"preview of {video_id} took over {PREVIEW_TIMEOUT}s")
+                time.sleep(0.1)
+            if process.returncode:
+                raise RuntimeError(f"ffmpeg: {process.stderr.read().decode(errors='replace').strip()[-300:]}")
+        except BaseException:
+            process.kill()
+            process.wait()
+            try:
+                os.remove(output)
+            except OSError:
+                pass
+            raise
+        finally:
+            process.stderr.close()
+    _count_downloaded(output, "youtube_preview")
+    return output
 
-def download_from_youtube(video_id_or_url):
+def download_from_youtube(video_id_or_url, cancel_event=None):
     """Download best audio for a given YouTube video id quickly.
     Prefer AAC/M4A to avoid heavy transcoding; store in downloads/.
-    Returns the full file path.
+    Returns the full file path. Setting cancel_event aborts the transfer and
+    removes partial files.
     """
-    downloads_dir = _ensure_download_dir("downloads")
-    outtmpl = '%(id)s.%(ext)s'
-    if downloads_dir:
-        outtmpl = os.path.join(downloads_dir, outtmpl)
-
-    ydl_opts = {
-        # Prefer AAC/M4A, then fallback to best available
-        'format': 'bestaudio[acodec~=^mp4a]/bestaudio[ext=m4a]/bestaudio/best',
-        'noplaylist': True,
-        'quiet': True,
-        'no_warnings': True,
-        'outtmpl': outtmpl,
-        'socket_timeout': 30,
-        'retries': 3,
-        'nocheckcertificate': True,
-        'fixup': 'never',
-        'ffmpeg_location': 'ffmpeg',
-    }
+    hook = CancelHook(cancel_event)
+    hook.check()
+    _ensure_download_dir(SCRATCH_DIR)
 
     # Accept both raw video id and full URL
     url = video_id_or_url if isinstance(video_id_or_url, str) and video_id_or_url.startswith("http") else f"https://www.youtube.com/watch?v={video_id_or_url}"
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(url, download=True)
-
-        # Try to get precise downloaded file path
-        new_filename = None
-        try:
-            if 'requested_downloads' in info and info['requested_downloads']:
-                new_filename = info['requested_downloads'][0].get('filepath')
-        except Exception:
-            new_filename = None
-
-        if not new_filename:
-            new_filename = ydl.prepare_filename(info)
+    try:
+        with timer("download", source="youtube"), AUDIO_POOL.checkout(progress_hook=hook) as ydl:
+            new_filename = chunked.download(ydl, url, hook)
 
-        return new_filename
\ No newline at end of file
+            _count_downloaded(new_filename, "youtube")
+            return new_filename
+    except BaseException:
+        # Bekor qilingan yoki xato bilan tugagan yuklash qoldiqlarini tozalaymiz
+        hook.cleanup()
+        raise